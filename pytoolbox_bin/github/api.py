@@ -0,0 +1,212 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib, json, os, threading
+from codecs import open
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urljoin, urlsplit
+from urllib.request import Request, urlopen
+
+API_URL = 'https://api.github.com/'
+
+
+class GitHubClient(object):
+    """
+    A minimal client of the GitHub API (v3) with a cache of the responses based on conditional requests.
+
+    Every response is saved into `cache_directory` with its ``ETag`` and the following requests of the same URL are
+    conditional (``If-None-Match``). An unchanged resource costs a ``304 Not Modified`` response without any body and
+    does not count against the rate limit of the API.
+
+    The paginated resources are requested page by page until a page is not full. The pages are not followed with their
+    ``Link`` header because it is not covered by the ``ETag`` (e.g. a new page is added after an unchanged full one).
+
+    **Example usage**
+
+    >>> import tempfile
+    >>> repositories = [{'full_name': 'me/project%d' % i, 'clone_url': 'https://github.com/me/project%d.git' % i}
+    ...                 for i in range(5)]
+    >>> with GitHubStub({'me': repositories}) as stub:
+    ...     client = GitHubClient(stub.url, cache_directory=tempfile.mkdtemp(), per_page=2)
+    ...     print(len(client.starred('me')), client.requests, client.not_modified)
+    ...     print(len(client.starred('me')), client.requests, client.not_modified)
+    ...     stub.stars['me'].append({'full_name': 'me/new', 'clone_url': 'https://github.com/me/new.git'})
+    ...     print(len(client.starred('me')), client.requests, client.not_modified)
+    5 3 0
+    5 6 3
+    6 10 5
+    """
+
+    USER_AGENT = 'pytoolbox_bin'
+
+    def __init__(self, api_url=API_URL, token=None, cache_directory=None, per_page=100, timeout=60):
+        """
+        Construct a GitHubClient.
+
+        :param api_url: URL of the API
+        :type api_url: str
+        :param token: A personal access token (requests are anonymous if not set)
+        :type token: str
+        :param cache_directory: Where to save the responses, responses are not cached if not set
+        :type cache_directory: str
+        :param per_page: Number of items per page of the paginated resources
+        :type per_page: int
+        """
+        self.api_url = api_url if api_url.endswith('/') else api_url + '/'
+        self.token = token
+        self.cache_directory = cache_directory
+        self.per_page = per_page
+        self.timeout = timeout
+        self.requests = self.not_modified = 0
+        self._lock = threading.Lock()
+        if cache_directory and not os.path.isdir(cache_directory):
+            os.makedirs(cache_directory)
+
+    def get(self, url):
+        """Return the decoded body of the resource `url` (relative to the API)."""
+        url = urljoin(self.api_url, url)
+        cached = self._read_cache(url)
+        headers = {'Accept': 'application/vnd.github.v3+json', 'User-Agent': self.USER_AGENT}
+        if self.token:
+            headers['Authorization'] = 'token ' + self.token
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        try:
+            with urlopen(Request(url, headers=headers), timeout=self.timeout) as response:
+                body, etag = response.read().decode('utf-8'), response.headers.get('ETag')
+        except HTTPError as e:
+            if e.code != 304 or not cached:
+                raise
+            with self._lock:
+                self.requests += 1
+                self.not_modified += 1
+            return json.loads(cached['body'])
+        with self._lock:
+            self.requests += 1
+        self._write_cache(url, {'etag': etag, 'body': body})
+        return json.loads(body)
+
+    def iter_pages(self, url):
+        """Yield the items of the paginated resource `url`, page by page."""
+        page = 1
+        while True:
+            items = self.get('{0}{1}{2}'.format(url, '&' if '?' in url else '?',
+                                                urlencode({'page': page, 'per_page': self.per_page})))
+            for item in items:
+                yield item
+            if len(items) < self.per_page:
+                break
+            page += 1
+
+    def starred(self, username):
+        """Return the repositories starred by `username`, see :func:`repository_info`."""
+        return [repository_info(r) for r in self.iter_pages('users/{0}/starred'.format(username))]
+
+    def repository(self, full_name):
+        """Return the repository `full_name` with the root of its fork network, see :func:`repository_info`."""
+        return repository_info(self.get('repos/{0}'.format(full_name)))
+
+    def _cache_path(self, url):
+        return os.path.join(self.cache_directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _read_cache(self, url):
+        if not self.cache_directory:
+            return None
+        try:
+            with open(self._cache_path(url), 'r', encoding='utf-8') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return None
+
+    def _write_cache(self, url, data):
+        if self.cache_directory:
+            path = self._cache_path(url)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data))
+            os.rename(path + '.tmp', path)
+
+
+def repository_info(repository):
+    """
+    Return the metadata of a `repository` (as returned by the API) used to synchronize its clone.
+
+    The ``source`` (root of the fork network) is only returned by the API for a single repository, not in the lists.
+    """
+    info = {
+        'full_name': repository['full_name'], 'clone_url': repository['clone_url'],
+        'pushed_at': repository.get('pushed_at'), 'default_branch': repository.get('default_branch'),
+        'size': repository.get('size'), 'fork': repository.get('fork', False)
+    }
+    if repository.get('source'):
+        info['source'] = {k: repository['source'][k] for k in ('full_name', 'clone_url')}
+    return info
+
+
+class GitHubStub(object):
+    """
+    A local HTTP server standing in for the GitHub API, useful to test :class:`GitHubClient`.
+
+    Serves the (paginated) starred repositories of the users, `stars` maps the usernames to lists of repositories, and
+    the repositories themselves (looked up by full name into the stars). The responses have an ``ETag`` and the
+    conditional requests are honored.
+    """
+
+    def __init__(self, stars, address='127.0.0.1', port=0):
+        self.stars = stars
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                parts, query = url.path.strip('/').split('/'), parse_qs(url.query)
+                if len(parts) == 3 and parts[0] == 'users' and parts[2] == 'starred' and parts[1] in stub.stars:
+                    page, per_page = int(query.get('page', [1])[0]), int(query.get('per_page', [30])[0])
+                    data = stub.stars[parts[1]][(page - 1) * per_page:page * per_page]
+                elif len(parts) == 3 and parts[0] == 'repos':
+                    full_name = '/'.join(parts[1:])
+                    data = next((r for s in stub.stars.values() for r in s if r['full_name'] == full_name), None)
+                else:
+                    data = None
+                if data is None:
+                    self.send_error(404)
+                    return
+                body = json.dumps(data).encode('utf-8')
+                etag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://{0}:{1}/'.format(*self.server.server_address)
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
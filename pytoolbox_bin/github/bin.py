@@ -2,21 +2,18 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import argparse, multiprocessing, os
+import argparse, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
 
-import github3
 from pytoolbox.encoding import configure_unicode
-from pytoolbox.filesystem import try_makedirs, try_remove
-from pytoolbox.subprocess import git_clone_or_pull
+from pytoolbox.filesystem import try_makedirs
 
-
-def clone_it(directory, repository):
-    print('Cloning/updating repository {0.full_name}'.format(repository))
-    directory = os.path.join(directory, repository.full_name)
-    try:
-        git_clone_or_pull(directory, repository.clone_url)
-    except KeyboardInterrupt:
-        try_remove(directory, recursive=True)
+from .api import API_URL, GitHubClient
+from .lib import (
+    IONICE_CLASSES, CloneStrategy, Manifest, ReferenceStore, benchmark_strategies, find_networks, maintain_repository,
+    print_outcome, remove_clone, summarize, summarize_maintenance, sync_repositories
+)
+from ..common import config_path
 
 
 def clone_starred():
@@ -26,30 +23,125 @@ def clone_starred():
     DEFAULT_OUTPUT = os.path.abspath(os.path.expanduser('~/github/stars'))
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      epilog=clone_starred.__doc__)
-    parser.add_argument('username',          help='Name of user whose stars you want to clone')
-    parser.add_argument('-o', '--output',    help='Clones directory',    default=DEFAULT_OUTPUT)
-    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=min(4, os.cpu_count() * 2))
-    parser.add_argument('-d', '--delete', action='store_true', help='Remove clones of unstarred repositories')
+    parser.add_argument('username',               help='Name of user whose stars you want to clone')
+    parser.add_argument('-o', '--output',         help='Clones directory', default=DEFAULT_OUTPUT)
+    parser.add_argument('-j', '--jobs', '-p', '--processes', help='Number of concurrent git operations', type=int,
+                        default=8)
+    parser.add_argument('-d', '--delete',         help='Remove clones of unstarred repositories', action='store_true')
+    parser.add_argument('-a', '--api-url',        help='URL of the GitHub API', default=API_URL)
+    parser.add_argument('-t', '--token',          help='GitHub access token (higher rate limit)',
+                        default=os.environ.get('GITHUB_TOKEN'))
+    parser.add_argument('-f', '--full',           help='Also synchronize unchanged repositories', action='store_true')
+    parser.add_argument('-P', '--per-host',       help='Maximum number of concurrent git operations per host',
+                        type=int, default=None)
+    parser.add_argument('-F', '--fixed-jobs',     help='Do not adapt the concurrency to the failures and slowdowns',
+                        action='store_true')
+    parser.add_argument('-m', '--maintenance',    help='Run git gc --auto and write the commit-graph of the updated '
+                                                       'repositories', action='store_true')
+    parser.add_argument('--maintenance-jobs',     help='Number of concurrent maintenance operations', type=int,
+                        default=2)
+    parser.add_argument('--ionice',               help='IO scheduling class of the maintenance operations',
+                        choices=sorted(IONICE_CLASSES) + ['none'], default='idle')
+    parser.add_argument('-r', '--reference',      help='Share the objects of the forks of a repository (new clones)',
+                        action='store_true')
+    add_strategy_arguments(parser)
     args = parser.parse_args()
 
     output = os.path.abspath(os.path.expanduser(args.output))
     try_makedirs(output)
 
-    starred_repositories = {r.full_name: r for r in github3.starred_by(args.username)}
+    # The responses of the API are cached, the unchanged pages are not downloaded again
+    client = GitHubClient(args.api_url, token=args.token, cache_directory=config_path('github-cache'))
+    starred_repositories = {r['full_name']: r for r in client.starred(args.username)}
+    print('Listed {0} starred repositories with {1} requests ({2} not modified)'.format(
+          len(starred_repositories), client.requests, client.not_modified))
 
+    manifest = Manifest(output)
+
+    # The clones of the unstarred repositories are removed in background while the others are synchronized
+    remover, removals = ThreadPoolExecutor(max_workers=2), []
     if args.delete:
-        for dirpath, dirnames, filenames in os.walk(output):
-            full_name = os.path.relpath(dirpath, output)
-            if full_name.count(os.path.sep) == 1:
-                if not full_name in starred_repositories:
-                    print('Remove clone of unstarred repository {0}'.format(full_name))
-                    try_remove(os.path.join(output, full_name), recursive=True)
-                dirnames.clear()
-
-    pool = multiprocessing.Pool(processes=args.processes)
-    for repository in starred_repositories.itervalues():
-        pool.apply_async(clone_it, args=(output, repository))
-    pool.close()
-    pool.join()
-
-    print('Job done!')
+        for full_name in manifest.unlisted(starred_repositories.values()):
+            print('Remove clone of unstarred repository {0}'.format(full_name))
+            removals.append(remover.submit(remove_clone, output, full_name))
+
+    strategy = get_strategy(args)
+    changed = [r for r in starred_repositories.values() if args.full or manifest.is_changed(r, strategy)]
+
+    networks = references = None
+    if args.reference:
+        networks = find_networks(starred_repositories.values(), client.repository)
+        references = ReferenceStore(os.path.join(output, '.references'))
+        print('Found {0} fork networks with {1} starred repositories'.format(
+              len(set(networks.values())), len(networks)))
+
+    # The updated repositories are maintained in background with a low IO priority
+    maintainer, maintenances = ThreadPoolExecutor(max_workers=args.maintenance_jobs), []
+    ionice = None if args.ionice == 'none' else args.ionice
+
+    def callback(outcome):
+        print_outcome(outcome)
+        if outcome['status'] != 'failed':
+            manifest.update(starred_repositories[outcome['full_name']], strategy)
+        if args.maintenance and outcome['status'] == 'updated':
+            maintenances.append(maintainer.submit(maintain_repository, output, outcome['full_name'], ionice))
+
+    start_time = time.monotonic()
+    try:
+        outcomes = sync_repositories(output, [(r['full_name'], r['clone_url']) for r in changed], jobs=args.jobs,
+                                     callback=callback, strategy=strategy, networks=networks,
+                                     references=references, per_host=args.per_host, adaptive=not args.fixed_jobs,
+                                     sizes={r['full_name']: r.get('size') for r in changed},
+                                     previous={r['full_name']: manifest.strategy(r) for r in changed})
+    except KeyboardInterrupt:
+        maintainer.shutdown(wait=False, cancel_futures=True)
+        sys.exit('Operation aborted by user.')
+    finally:
+        sync_duration = time.monotonic() - start_time
+        maintainer.shutdown(wait=True)
+        remover.shutdown(wait=True)
+        for removal in removals:
+            if removal.exception():
+                print('Unable to remove a clone, reason: {0}'.format(repr(removal.exception())))
+            else:
+                manifest.remove(removal.result())
+        manifest.save()
+    print(summarize(outcomes, sync_duration, unchanged=len(starred_repositories) - len(changed)))
+    if args.maintenance:
+        outcomes_maintenance = [m.result() for m in maintenances]
+        for failed in (o for o in outcomes_maintenance if o['error']):
+            print('Failed to maintain repository {full_name}, reason: {error}'.format(**failed))
+        print(summarize_maintenance(outcomes_maintenance, time.monotonic() - start_time - sync_duration))
+    if any(o['status'] == 'failed' for o in outcomes):
+        sys.exit(1)
+
+
+def benchmark_clones():
+    """Compare the time to clone and update the repositories and the disk space used by the clone strategies."""
+
+    configure_unicode()
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     epilog=benchmark_clones.__doc__)
+    parser.add_argument('repositories', nargs='+', help='Paths (or URLs) of the repositories to clone')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of concurrent git operations', default=8)
+    parser.add_argument('-d', '--depth', type=int, help='Depth of the shallow clones', default=1)
+    args = parser.parse_args()
+
+    urls = [r if '://' in r else 'file://' + os.path.abspath(os.path.expanduser(r)) for r in args.repositories]
+    strategies = [
+        CloneStrategy(), CloneStrategy(depth=args.depth), CloneStrategy(filter='blob:none'), CloneStrategy(mirror=True)
+    ]
+    print('{0:<24} {1:>10} {2:>10} {3:>12} {4:>7}'.format('Strategy', 'Clone [s]', 'Update [s]', 'Size [MB]', 'Failed'))
+    for result in benchmark_strategies(urls, strategies, jobs=args.jobs):
+        print('{strategy:<24} {clone:>10.2f} {update:>10.2f} {0:>12.1f} {failed:>7}'.format(result['size'] / 1024 ** 2,
+                                                                                         **result))
+
+
+def add_strategy_arguments(parser):
+    parser.add_argument('--depth',  type=int, help='Shallow clones of the last DEPTH commits', default=None)
+    parser.add_argument('--filter', help='Partial clones with this filter (e.g. blob:none)', default=None)
+    parser.add_argument('--mirror', action='store_true', help='Bare mirrors, updated with git remote update')
+
+
+def get_strategy(args):
+    return CloneStrategy(depth=args.depth, filter=args.filter, mirror=args.mirror)
@@ -0,0 +1,623 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json, os, shutil, tempfile, threading, time
+from codecs import open
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pytoolbox.filesystem import get_size, try_remove
+from pytoolbox.subprocess import cmd
+from urllib.parse import urlsplit
+
+#: The commands run by :func:`maintain_repository`, packing the loose objects only if needed
+MAINTENANCE_COMMANDS = (['git', 'gc', '--auto', '--quiet'], ['git', 'commit-graph', 'write', '--reachable'])
+
+#: The configuration of the reference repositories, their objects must never be pruned (see :class:`ReferenceStore`)
+REFERENCE_CONFIG = (('gc.auto', '0'), ('gc.pruneExpire', 'never'), ('maintenance.auto', 'false'))
+
+#: The IO scheduling classes of :func:`maintain_repository` (options of ionice)
+IONICE_CLASSES = {'idle': ['-c', '3'], 'best-effort': ['-c', '2', '-n', '7']}
+
+
+class AdaptiveLimiter(object):
+    """
+    Limit the number of concurrent operations, the limit is adapted with an AIMD (additive increase, multiplicative
+    decrease) rule like the congestion window of TCP.
+
+    The limit is halved when an operation fails or is slow and is increased by one every `limit` successful operations,
+    from `minimum` to `maximum`. An operation is slow if its cost (e.g. duration per size) is more than `slow_factor`
+    times the moving average of the costs (computed once `warmup` operations completed).
+
+    **Example usage**
+
+    >>> limiter = AdaptiveLimiter(8)
+    >>> for success in (False, False):
+    ...     limiter.acquire()
+    ...     limiter.release(success)
+    >>> limiter.limit
+    2.0
+    >>> for i in range(6):
+    ...     limiter.acquire()
+    ...     limiter.release(True)
+    >>> int(limiter.limit)
+    4
+    """
+
+    def __init__(self, maximum, minimum=1, slow_factor=3, warmup=5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.slow_factor = slow_factor
+        self.warmup = warmup
+        self.limit = float(maximum)
+        self.active = self.samples = 0
+        self.average_cost = None
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+
+    def release(self, success, cost=None):
+        """Release the slot of an operation, `cost` is an indicator of its slowness, e.g. duration per size."""
+        with self._condition:
+            self.active -= 1
+            slow = False
+            if success and cost is not None:
+                if self.samples >= self.warmup:
+                    slow = cost > self.slow_factor * self.average_cost
+                self.samples += 1
+                self.average_cost = cost if self.average_cost is None else 0.8 * self.average_cost + 0.2 * cost
+            if success and not slow:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(self.minimum, self.limit / 2)
+            self._condition.notify_all()
+
+
+class CloneStrategy(object):
+    """
+    How the repositories are cloned and updated.
+
+    * The default is a full clone with a working tree, updated with ``git pull`` (local changes are reset)
+    * Set `depth` to only fetch the last `depth` commits (shallow clone)
+    * Set `filter` to a partial clone filter, e.g. ``blob:none`` to fetch the blobs only when they are checked out
+    * Set `mirror` to clone a bare mirror of all the refs, updated with ``git remote update --prune``
+
+    The options can be combined. A clone is made again if it was created with another strategy (e.g. switching to
+    mirrors), see :func:`sync_repository`. A reference repository (see :class:`ReferenceStore`) can be given to the
+    clone command, the objects it contains are then borrowed (git alternates) instead of being fetched.
+
+    **Example usage**
+
+    >>> print(CloneStrategy(), CloneStrategy(depth=1), CloneStrategy(filter='blob:none', mirror=True))
+    full shallow(1) partial(blob:none)+mirror
+    >>> CloneStrategy(depth=1).clone_command('https://github.com/me/project.git', '/tmp/me/project')
+    ['git', 'clone', '--depth', '1', 'https://github.com/me/project.git', '/tmp/me/project']
+    >>> CloneStrategy(mirror=True).update_commands()
+    [['git', 'remote', 'update', '--prune']]
+    """
+
+    def __init__(self, depth=None, filter=None, mirror=False):
+        self.depth = depth
+        self.filter = filter
+        self.mirror = mirror
+
+    def __str__(self):
+        modes = [m for m, enabled in (
+            ('shallow({0})'.format(self.depth), self.depth), ('partial({0})'.format(self.filter), self.filter),
+            ('mirror', self.mirror)) if enabled]
+        return '+'.join(modes) or 'full'
+
+    def clone_command(self, url, path, reference=None):
+        command = ['git', 'clone']
+        if reference:
+            command.extend(['--reference-if-able', reference])
+        if self.mirror:
+            command.append('--mirror')
+        if self.depth:
+            command.extend(['--depth', str(self.depth)])
+        if self.filter:
+            command.append('--filter={0}'.format(self.filter))
+        return command + [url, path]
+
+    def is_layout_of(self, path):
+        """Return True if the layout of the clone `path` (bare or with a working tree) matches the strategy."""
+        bare = cmd(['git', 'rev-parse', '--is-bare-repository'], cwd=path)['stdout'].strip() == b'true'
+        return bare == self.mirror
+
+    def update_commands(self):
+        if self.mirror:
+            return [['git', 'remote', 'update', '--prune']]
+        pull = ['git', 'pull'] + (['--depth', str(self.depth)] if self.depth else [])
+        return [['git', 'reset', '--hard'], pull]
+
+
+class Manifest(object):
+    """
+    The state of the clones of an archive, saved into ``<directory>/.manifest.json``.
+
+    For every repository successfully synchronized, the manifest records the clone URL and the metadata returned by the
+    GitHub API that changes when the repository is pushed to (``pushed_at`` and ``default_branch``). This allows to
+    synchronize only the repositories that changed since the previous run. The strategy of the clone (see
+    :class:`CloneStrategy`) is recorded too, a repository cloned with another strategy is synchronized again.
+
+    The manifest is also the index of the clones managed into the directory: the clones of the repositories that are no
+    longer starred are found without walking the directory (see :meth:`unlisted`). The clones found into the directory
+    (``<owner>/<name>``) are adopted when the manifest is created.
+
+    **Example usage**
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> repository = {'full_name': 'me/project', 'clone_url': 'https://github.com/me/project.git',
+    ...               'pushed_at': '2014-03-25T08:15:00Z', 'default_branch': 'master'}
+    >>> os.makedirs(os.path.join(directory, 'me', 'project'))
+    >>> manifest = Manifest(directory)
+    >>> manifest.is_changed(repository)
+    True
+    >>> manifest.update(repository)
+    >>> manifest.save()
+    >>> Manifest(directory).is_changed(repository)
+    False
+    >>> Manifest(directory).is_changed(dict(repository, pushed_at='2014-03-26T10:00:00Z'))
+    True
+    >>> Manifest(directory).is_changed(repository, CloneStrategy(mirror=True)), Manifest(directory).strategy(repository)
+    (True, 'full')
+    >>> os.makedirs(os.path.join(directory, 'me', 'old'))
+    >>> sorted(Manifest(tempfile.mkdtemp()).repositories), Manifest(directory).unlisted([repository])
+    ([], [])
+    >>> os.remove(manifest.path)
+    >>> Manifest(directory).unlisted([repository])
+    ['me/old']
+    """
+
+    FILENAME = '.manifest.json'
+    KEYS = ('clone_url', 'pushed_at', 'default_branch')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILENAME)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.repositories = json.loads(f.read())['repositories']
+        except IOError:
+            self.repositories = {n: {} for n in self._scan()}
+
+    def _scan(self):
+        """Return the full name of the clones found into the directory."""
+        if not os.path.isdir(self.directory):
+            return []
+        full_names = []
+        for owner in os.scandir(self.directory):
+            if owner.is_dir() and not owner.name.startswith('.'):
+                full_names.extend('{0}/{1}'.format(owner.name, e.name) for e in os.scandir(owner.path) if e.is_dir())
+        return full_names
+
+    def is_changed(self, repository, strategy=None):
+        """
+        Return True if the `repository` (a dictionary) changed since it was synchronized, its clone is missing or was
+        made with another `strategy` (full clone by default).
+        """
+        state = self.repositories.get(repository['full_name'])
+        recorded = self.strategy(repository)
+        return (state is None or any(state.get(k) != repository.get(k) for k in self.KEYS) or
+                recorded is not None and recorded != str(strategy or CloneStrategy()) or
+                not os.path.exists(os.path.join(self.directory, repository['full_name'])))
+
+    def strategy(self, repository):
+        """Return the strategy the clone of the `repository` was made with, None if unknown (e.g. adopted clone)."""
+        return self.repositories.get(repository['full_name'], {}).get('strategy')
+
+    def unlisted(self, repositories):
+        """Return the full name of the clones of the repositories that are not in `repositories` (dictionaries)."""
+        return sorted(set(self.repositories) - set(r['full_name'] for r in repositories))
+
+    def update(self, repository, strategy=None):
+        state = {k: repository.get(k) for k in self.KEYS}
+        state['strategy'] = str(strategy or CloneStrategy())
+        self.repositories[repository['full_name']] = state
+
+    def remove(self, full_name):
+        self.repositories.pop(full_name, None)
+
+    def save(self):
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': 1, 'repositories': self.repositories}, indent=2, sort_keys=True))
+        os.rename(self.path + '.tmp', self.path)
+
+
+class ReferenceStore(object):
+    """
+    Bare repositories shared by the clones of the members of a fork network (e.g. a repository and its forks).
+
+    The reference repository of a network is a bare clone of the root of the network. The members are cloned with it as
+    reference, the objects they share with the root are borrowed (git alternates) instead of being fetched and stored
+    once more. The reference repositories are only fetched into, never pruned, because the clones depend on them: the
+    automatic garbage collection and maintenance are disabled and the unreachable objects never expire (e.g. the objects
+    of a branch deleted or rewritten upstream), see :data:`REFERENCE_CONFIG`.
+
+    The reference repository of a network is cloned or updated (once per run) by the first member that needs it, the
+    other members of the network wait for it while the members of the other networks proceed.
+
+    **Example usage**
+
+    >>> import subprocess
+    >>> source, directory = tempfile.mkdtemp(), tempfile.mkdtemp()
+    >>> _ = subprocess.check_output(['git', 'init', '-q', source])
+    >>> _ = subprocess.check_output(['git', '-C', source, '-c', 'user.name=me', '-c', 'user.email=me@example.com',
+    ...                              'commit', '-q', '--allow-empty', '-m', 'First'])
+    >>> store = ReferenceStore(os.path.join(directory, '.references'))
+    >>> reference = store.prepare('me/project', source)
+    >>> outcome = sync_repository(directory, 'you/project', source, reference=reference)
+    >>> with open(os.path.join(directory, 'you', 'project', '.git', 'objects', 'info', 'alternates')) as f:
+    ...     f.read().strip() == os.path.join(reference, 'objects')
+    True
+    >>> print(subprocess.check_output(['git', '-C', reference, 'config', 'gc.pruneExpire']).decode('utf-8').strip())
+    never
+    """
+
+    def __init__(self, directory, **kwargs):
+        self.directory = directory
+        self.kwargs = kwargs
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._ready = set()
+
+    def path(self, network):
+        return os.path.join(self.directory, network + '.git')
+
+    def prepare(self, network, url):
+        """Clone or update (once) the reference repository of the `network` from `url` and return its path."""
+        with self._lock:
+            lock = self._locks.setdefault(network, threading.Lock())
+        path = self.path(network)
+        with lock:
+            if network not in self._ready:
+                if os.path.exists(path):
+                    self.configure(path)  # The reference repositories created by a previous version
+                    cmd(['git', 'fetch', '--quiet', url, '+refs/heads/*:refs/heads/*'], cwd=path, **self.kwargs)
+                else:
+                    try:
+                        cmd(['git', 'init', '--bare', '--quiet', path], **self.kwargs)
+                        self.configure(path)
+                        cmd(['git', 'fetch', '--quiet', url, '+refs/heads/*:refs/heads/*'], cwd=path, **self.kwargs)
+                    except Exception:
+                        try_remove(path, recursive=True)
+                        raise
+                self._ready.add(network)
+        return path
+
+    def configure(self, path):
+        """Disable the pruning of the objects of the reference repository `path`."""
+        for key, value in REFERENCE_CONFIG:
+            cmd(['git', 'config', key, value], cwd=path, **self.kwargs)
+
+
+def find_networks(repositories, get_repository):
+    """
+    Return a dictionary mapping the full name of the repositories to the root of their fork network (full_name,
+    clone_url), for the networks with at least two of the `repositories`.
+
+    The root of the forks is retrieved by calling `get_repository` (e.g. :meth:`GitHubClient.repository`).
+
+    **Example usage**
+
+    >>> repositories = [{'full_name': 'me/project', 'clone_url': 'me.git', 'fork': False},
+    ...                 {'full_name': 'you/project', 'clone_url': 'you.git', 'fork': True},
+    ...                 {'full_name': 'him/other', 'clone_url': 'him.git', 'fork': True}]
+    >>> sources = {'you/project': {'full_name': 'me/project', 'clone_url': 'me.git'},
+    ...            'him/other': {'full_name': 'her/other', 'clone_url': 'her.git'}}
+    >>> find_networks(repositories, lambda full_name: {'source': sources[full_name]})
+    {'me/project': ('me/project', 'me.git'), 'you/project': ('me/project', 'me.git')}
+    """
+    members = {}
+    for repository in repositories:
+        source = repository
+        if repository.get('fork'):
+            source = get_repository(repository['full_name']).get('source') or repository
+        members.setdefault((source['full_name'], source['clone_url']), []).append(repository['full_name'])
+    return {n: network for network, names in members.items() if len(names) > 1 for n in names}
+
+
+def sync_repository(directory, full_name, clone_url, strategy=None, reference=None, previous=None, **kwargs):
+    """
+    Clone or update the repository `full_name` into `directory`/`full_name` and return the outcome.
+
+    The repository is cloned and updated with the `strategy` (a :class:`CloneStrategy`, full clone by default), with
+    the objects of the `reference` repository (if set, see :class:`ReferenceStore`). The extra keyword arguments are
+    passed to the git commands (:func:`pytoolbox.subprocess.cmd`).
+
+    An existing clone made with another strategy is replaced by a new clone (the old one is kept if the clone fails).
+    The `previous` strategy of the clone (see :meth:`Manifest.strategy`) is compared to the `strategy`, the layout of
+    the clone (bare or not) is checked instead if it is unknown.
+
+    The outcome is a dictionary with the name of the repository, the status (``cloned``, ``updated`` or ``failed``), the
+    duration of the operation in seconds and the error (if any). A clone that failed is removed.
+
+    **Example usage**
+
+    >>> import subprocess
+    >>> source, directory = tempfile.mkdtemp(), tempfile.mkdtemp()
+    >>> _ = subprocess.check_output(['git', 'init', '-q', source])
+    >>> _ = subprocess.check_output(['git', '-C', source, '-c', 'user.name=me', '-c', 'user.email=me@example.com',
+    ...                              'commit', '-q', '--allow-empty', '-m', 'First'])
+    >>> for strategy in (CloneStrategy(), CloneStrategy(mirror=True), CloneStrategy(mirror=True), CloneStrategy()):
+    ...     outcome = sync_repository(directory, 'me/project', source, strategy)
+    ...     print(outcome['status'], outcome['error'], os.path.exists(os.path.join(directory, 'me/project/.git')))
+    cloned None True
+    cloned None False
+    updated None False
+    cloned None True
+    """
+    path = os.path.join(directory, full_name)
+    exists = os.path.exists(path)
+    strategy = strategy or CloneStrategy()
+    start_time = time.monotonic()
+    outcome = {'full_name': full_name, 'status': 'updated' if exists else 'cloned', 'error': None}
+    try:
+        if exists and (str(strategy) != previous if previous else not strategy.is_layout_of(path)):
+            outcome['status'] = 'cloned'
+            temporary_path = path + '.reclone'
+            try_remove(temporary_path, recursive=True)
+            try:
+                cmd(strategy.clone_command(clone_url, temporary_path, reference), **kwargs)
+            except Exception:
+                try_remove(temporary_path, recursive=True)
+                raise
+            try_remove(path, recursive=True)
+            os.rename(temporary_path, path)
+        elif exists:
+            for command in strategy.update_commands():
+                cmd(command, cwd=path, **kwargs)
+        else:
+            cmd(strategy.clone_command(clone_url, path, reference), **kwargs)
+    except Exception as e:
+        error = getattr(e, 'output', None) or repr(e)  # Output of the git command if it failed
+        if isinstance(error, bytes):
+            error = error.decode('utf-8', 'replace')
+        outcome.update({'status': 'failed', 'error': error.strip()})
+        if not exists:
+            try_remove(path, recursive=True)
+    outcome['duration'] = time.monotonic() - start_time
+    return outcome
+
+
+def remove_clone(directory, full_name):
+    """Remove the clone of the repository `full_name` from `directory` (and the directory of its owner if empty)."""
+    path = os.path.join(directory, full_name)
+    try_remove(path, recursive=True)
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass  # Other clones of the same owner
+    return full_name
+
+
+def sync_repositories(directory, repositories, jobs=8, callback=None, strategy=None, networks=None, references=None,
+                      sizes=None, per_host=None, adaptive=True, previous=None, **kwargs):
+    """
+    Clone or update the `repositories` (an iterable of (full_name, clone_url)) concurrently and return the outcomes.
+
+    The git commands are run by up to `jobs` threads, the work is bound by the network and the disk, not by the CPU.
+    The `callback` is called with the outcome of every repository as soon as it is synchronized. The pending operations
+    are cancelled if the user interrupts the synchronization. See :func:`sync_repository` for the other arguments.
+
+    The repositories are scheduled from the largest to the smallest (`sizes` maps their full name to their size in KB),
+    a large repository started last would dominate the total time. At most `per_host` operations (if set) are run
+    concurrently with a given host. If `adaptive` is set, the concurrency is reduced when operations fail or slow down
+    and increased back progressively, see :class:`AdaptiveLimiter`.
+
+    The members of the `networks` (see :func:`find_networks`) are cloned with the reference repository of their network
+    (from the `references`, a :class:`ReferenceStore`). They are cloned without reference if it cannot be prepared. The
+    reference repositories are only prepared for the members that are not cloned yet.
+
+    The `previous` strategies of the clones (a dictionary mapping the full names to strategies, see
+    :meth:`Manifest.strategy`) are given to :func:`sync_repository`.
+
+    **Example usage**
+
+    >>> import subprocess, tempfile
+    >>> source, output = tempfile.mkdtemp(), tempfile.mkdtemp()
+    >>> _ = subprocess.check_output(['git', 'init', '-q', source])
+    >>> outcomes = sync_repositories(output, [('me/project', source), ('me/missing', source + '-missing')], jobs=2)
+    >>> sorted((o['full_name'], o['status']) for o in outcomes)
+    [('me/missing', 'failed'), ('me/project', 'cloned')]
+    >>> os.path.exists(os.path.join(output, 'me', 'project')), os.path.exists(os.path.join(output, 'me', 'missing'))
+    (True, False)
+    """
+    networks, sizes, previous = networks or {}, sizes or {}, previous or {}
+    limiter = AdaptiveLimiter(jobs) if adaptive else None
+    hosts, hosts_lock = {}, threading.Lock()
+
+    def sync(full_name, clone_url):
+        host_semaphore = None
+        if per_host:
+            with hosts_lock:
+                host = urlsplit(clone_url).hostname or 'localhost'
+                host_semaphore = hosts.setdefault(host, threading.Semaphore(per_host))
+            host_semaphore.acquire()
+        if limiter:
+            limiter.acquire()
+        outcome = None
+        try:
+            reference = None
+            if references and full_name in networks and not os.path.exists(os.path.join(directory, full_name)):
+                try:
+                    reference = references.prepare(*networks[full_name])
+                except Exception as e:
+                    print('Unable to prepare the reference repository of {0}, reason: {1}'.format(full_name, repr(e)))
+            outcome = sync_repository(directory, full_name, clone_url, strategy, reference, previous.get(full_name),
+                                      **kwargs)
+            return outcome
+        finally:
+            if limiter:
+                # Seconds per MB, the small repositories are dominated by the latency
+                cost = outcome['duration'] / (1 + (sizes.get(full_name) or 0) / 1024) if outcome else None
+                limiter.release(outcome is not None and outcome['status'] != 'failed', cost)
+            if host_semaphore:
+                host_semaphore.release()
+
+    repositories = sorted(repositories, key=lambda r: sizes.get(r[0]) or 0, reverse=True)
+    outcomes = []
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures = [executor.submit(sync, n, u) for n, u in repositories]
+        for future in as_completed(futures):
+            outcome = future.result()
+            outcomes.append(outcome)
+            if callback:
+                callback(outcome)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return outcomes
+
+
+def maintain_repository(directory, full_name, ionice='idle', **kwargs):
+    """
+    Run the maintenance commands (:data:`MAINTENANCE_COMMANDS`) into the clone of the repository `full_name` and
+    return the outcome.
+
+    The outcome is a dictionary with the name of the repository, the duration of the maintenance in seconds, the disk
+    space reclaimed by the objects in bytes (see :func:`objects_size`) and the error (if any). The commands are run
+    with the IO scheduling class `ionice` (see :data:`IONICE_CLASSES`, ignored if ionice is not available or if
+    `ionice` is None).
+
+    **Example usage**
+
+    >>> import subprocess
+    >>> directory = tempfile.mkdtemp()
+    >>> _ = subprocess.check_output(['git', 'init', '-q', os.path.join(directory, 'me', 'project')])
+    >>> outcome = maintain_repository(directory, 'me/project')
+    >>> print(outcome['full_name'], outcome['error'], outcome['reclaimed'] >= 0)
+    me/project None True
+    """
+    path = os.path.join(directory, full_name)
+    prefix = ['ionice'] + IONICE_CLASSES[ionice] if ionice and shutil.which('ionice') else []
+    outcome = {'full_name': full_name, 'error': None}
+    start_time = time.monotonic()
+    try:
+        size = objects_size(path, **kwargs)
+        for command in MAINTENANCE_COMMANDS:
+            cmd(prefix + command, cwd=path, **kwargs)
+        outcome['reclaimed'] = size - objects_size(path, **kwargs)
+    except Exception as e:
+        outcome.update({'error': repr(e), 'reclaimed': 0})
+    outcome['duration'] = time.monotonic() - start_time
+    return outcome
+
+
+def objects_size(path, **kwargs):
+    """
+    Return the disk space used by the objects of the repository `path` in bytes (loose objects, packs and garbage).
+
+    The size is read from ``git count-objects``, much faster than walking the files of the repository.
+
+    **Example usage**
+
+    >>> import subprocess
+    >>> path = tempfile.mkdtemp()
+    >>> _ = subprocess.check_output(['git', 'init', '-q', path])
+    >>> objects_size(path)
+    0
+    """
+    output = cmd(['git', 'count-objects', '-v'], cwd=path, **kwargs)['stdout'].decode('utf-8')
+    counts = dict(line.split(': ', 1) for line in output.splitlines() if ': ' in line)
+    return sum(int(counts.get(k, 0)) for k in ('size', 'size-pack', 'size-garbage')) * 1024
+
+
+def summarize_maintenance(outcomes, duration):
+    """
+    Return a summary of the maintenance of the repositories, `duration` is the time it took after the synchronization.
+
+    **Example usage**
+
+    >>> print(summarize_maintenance([
+    ...     {'full_name': 'a/b', 'duration': 2.0, 'reclaimed': 3 * 1024 ** 2, 'error': None},
+    ...     {'full_name': 'c/d', 'duration': 0.5, 'reclaimed': 0, 'error': 'Oups'}], 2.1))
+    Maintained 2 repositories with 2.5 seconds of git (2.1 seconds after the sync), reclaimed 3.0 MB, 1 failed
+    """
+    return 'Maintained {0} repositories with {1:.1f} seconds of git ({2:.1f} seconds after the sync), reclaimed ' \
+           '{3:.1f} MB, {4} failed'.format(len(outcomes), sum(o['duration'] for o in outcomes), duration,
+                                          sum(o['reclaimed'] for o in outcomes) / 1024 ** 2,
+                                          sum(1 for o in outcomes if o['error']))
+
+
+def print_outcome(outcome):
+    if outcome['status'] == 'failed':
+        print('Failed to clone/update repository {full_name}, reason: {error}'.format(**outcome))
+    else:
+        print('Repository {full_name} {status} in {duration:.1f} seconds'.format(**outcome))
+
+
+def summarize(outcomes, duration, unchanged=0, slowest=5):
+    """
+    Return a summary of the synchronization: the number of repositories per status, the failures and the slowest ones.
+
+    Set `unchanged` to the number of repositories skipped because they did not change.
+
+    **Example usage**
+
+    >>> print(summarize([
+    ...     {'full_name': 'a/b', 'status': 'cloned', 'duration': 12.0, 'error': None},
+    ...     {'full_name': 'c/d', 'status': 'failed', 'duration': 0.5, 'error': 'Not found'},
+    ...     {'full_name': 'e/f', 'status': 'updated', 'duration': 1.0, 'error': None}], 13.2, slowest=2))
+    Synchronized 3 repositories in 13.2 seconds: 1 cloned, 1 updated, 1 failed
+    Slowest: a/b (12.0 s), e/f (1.0 s)
+    Failed: c/d (Not found)
+    """
+    counts = {s: sum(1 for o in outcomes if o['status'] == s) for s in ('cloned', 'updated', 'failed')}
+    lines = ['Synchronized {0} repositories in {1:.1f} seconds: {cloned} cloned, {updated} updated, {failed} failed'
+             .format(len(outcomes), duration, **counts) + (', {0} unchanged'.format(unchanged) if unchanged else '')]
+    succeeded = sorted((o for o in outcomes if o['status'] != 'failed'), key=lambda o: o['duration'], reverse=True)
+    if succeeded:
+        lines.append('Slowest: ' + ', '.join('{full_name} ({duration:.1f} s)'.format(**o) for o in succeeded[:slowest]))
+    failed = [o for o in outcomes if o['status'] == 'failed']
+    if failed:
+        lines.append('Failed: ' + ', '.join('{full_name} ({error})'.format(**o) for o in failed))
+    return '\n'.join(lines)
+
+
+def benchmark_strategies(urls, strategies, jobs=8):
+    """
+    Clone the repositories `urls` with every strategy (a :class:`CloneStrategy`) and return the results.
+
+    The results are, per strategy: the time to clone the repositories, the time to update them (nothing changed) and
+    the disk space used by the clones. The clones are made into temporary directories and removed.
+
+    The partial clones filters are enabled on the server side for the local repositories (``file://`` URLs).
+
+    **Example usage**
+
+    >>> import subprocess
+    >>> source = tempfile.mkdtemp()
+    >>> _ = subprocess.check_output(['git', 'init', '-q', source])
+    >>> for i in range(3):
+    ...     with open(os.path.join(source, 'file'), 'w') as f:
+    ...         print('version %d' % i * 1000, file=f)
+    ...     _ = subprocess.check_output(['git', '-C', source, 'add', 'file'])
+    ...     _ = subprocess.check_output(['git', '-C', source, '-c', 'user.name=me', '-c', 'user.email=me@example.com',
+    ...                                  'commit', '-q', '-m', 'Version %d' % i])
+    >>> results = benchmark_strategies(['file://' + source], [CloneStrategy(), CloneStrategy(depth=1)])
+    >>> [(r['strategy'], r['failed']) for r in results]
+    [('full', 0), ('shallow(1)', 0)]
+    >>> results[0]['size'] > results[1]['size']
+    True
+    """
+    env = dict(os.environ, GIT_CONFIG_COUNT='1', GIT_CONFIG_KEY_0='uploadpack.allowFilter', GIT_CONFIG_VALUE_0='true')
+    repositories = [('{0}/{1}'.format(i, os.path.basename(u.rstrip('/'))), u) for i, u in enumerate(urls)]
+    results = []
+    for strategy in strategies:
+        directory = tempfile.mkdtemp()
+        try:
+            result = {'strategy': str(strategy)}
+            for operation in ('clone', 'update'):
+                start_time = time.monotonic()
+                outcomes = sync_repositories(directory, repositories, jobs=jobs, strategy=strategy, env=env)
+                result[operation] = time.monotonic() - start_time
+            result.update({'failed': sum(1 for o in outcomes if o['status'] == 'failed'), 'size': get_size(directory)})
+            results.append(result)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
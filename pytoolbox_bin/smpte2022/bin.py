@@ -2,7 +2,7 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import doctest, errno, logging, signal, socket
+import doctest, errno, json, logging, signal, socket
 from pytoolbox.encoding import configure_unicode
 from pytoolbox.logging import setup_logging
 from pytoolbox.network.ip import IPSocket
@@ -17,9 +17,11 @@ def socket_fec_generator():
 
     * Parse arguments from command line
     * Register handlers to SIGTERM and SIGINT
+    * Register handler to SIGHUP to reload the settings from the configuration file (if any)
+    * Register handler to SIGUSR1 to log the statistics
     * Instantiate a :mod:`SocketFecGenerator` and start it
     """
-    from .lib import SocketFecGenerator
+    from .lib import SocketFecGenerator, StreamAnalyzer, load_config
 
     configure_unicode()
     setup_logging(name='smpte2022lib', filename=None, console=True, level=logging.DEBUG)
@@ -28,39 +30,58 @@ def socket_fec_generator():
     log.info('OK')
 
     HELP_MEDIA   = 'Socket of input stream'
-    HELP_COL     = 'Socket of generated FEC column stream'
-    HELP_ROW     = 'Socket of generated FEC row stream'
+    HELP_COL     = 'Socket(s) of generated FEC column stream'
+    HELP_ROW     = 'Socket(s) of generated FEC row stream'
     HELP_L       = 'Horizontal size of the FEC matrix (columns)'
     HELP_D       = 'Vertical size of the FEC matrix (rows)'
     HELP_TIMEOUT = 'Set timeout for socket operations (in seconds)'
     HELP_PROFILE = 'Set profiling output file (this enable profiling)'
     HELP_STOP    = 'Automatic stop time (in seconds)'
+    HELP_CONFIG  = 'Settings (JSON with keys l, d, col, row) overriding the arguments, reloaded on SIGHUP'
+    HELP_ANALYZE = 'Analyze the health of the input stream (statistics are logged on SIGUSR1 and at exit)'
 
     dmedia = SocketFecGenerator.DEFAULT_MEDIA
-    dcol = SocketFecGenerator.DEFAULT_COL
-    drow = SocketFecGenerator.DEFAULT_ROW
+    dcol = [IPSocket(SocketFecGenerator.DEFAULT_COL)]
+    drow = [IPSocket(SocketFecGenerator.DEFAULT_ROW)]
 
     parser = ArgumentParser(
         formatter_class=ArgumentDefaultsHelpFormatter,
         epilog='''This utility create SMPTE 2022-1 FEC streams from a sniffed source stream.
                    SMPTE 2022-1 help streaming systems to improve QoE of real-time RTP transmissions.''')
     parser.add_argument('-m', '--media',        type=IPSocket,      help=HELP_MEDIA,   default=dmedia)
-    parser.add_argument('-c', '--col',          type=IPSocket,      help=HELP_COL,     default=dcol)
-    parser.add_argument('-r', '--row',          type=IPSocket,      help=HELP_ROW,     default=drow)
+    parser.add_argument('-c', '--col',          type=IPSocket,      help=HELP_COL,     nargs='+', default=dcol)
+    parser.add_argument('-r', '--row',          type=IPSocket,      help=HELP_ROW,     nargs='+', default=drow)
     parser.add_argument('-l',                   type=int,           help=HELP_L,       default=5)
     parser.add_argument('-d',                   type=int,           help=HELP_D,       default=6)
     parser.add_argument('-t', '--timeout',      type=int,           help=HELP_TIMEOUT, nargs='?', default=None)
     parser.add_argument('-s', '--stop-time',    type=int,           help=HELP_STOP,    nargs='?', default=None)
     parser.add_argument('-p', '--profile',      type=FileType('w'), help=HELP_PROFILE, nargs='?', default=None)
+    parser.add_argument('-f', '--config',                           help=HELP_CONFIG,  default=None)
+    parser.add_argument('-a', '--analyze',      action='store_true', help=HELP_ANALYZE)
     args = parser.parse_args()
 
     def handle_stop_signal(SIGNAL, stack):
         generator.stop()
 
+    def handle_reload_signal(SIGNAL, stack):
+        log.info('Reloading settings from {0}'.format(args.config))
+        try:
+            generator.reconfigure(**load_config(args.config))
+        except Exception as e:
+            log.error('Settings not reloaded, reason: {0}'.format(repr(e)))
+
+    def handle_stats_signal(SIGNAL, stack):
+        log.info('Statistics: {0}'.format(json.dumps(generator.stats, sort_keys=True)))
+
     try:
         signal.signal(signal.SIGTERM, handle_stop_signal)
         signal.signal(signal.SIGINT, handle_stop_signal)
-        generator = SocketFecGenerator(args.media, args.col, args.row, args.l, args.d)
+        analyzer = StreamAnalyzer() if args.analyze else None
+        generator = SocketFecGenerator(args.media, args.col, args.row, args.l, args.d, analyzer=analyzer)
+        signal.signal(signal.SIGUSR1, handle_stats_signal)
+        if args.config:
+            generator.reconfigure(**load_config(args.config))
+            signal.signal(signal.SIGHUP, handle_reload_signal)
         if args.profile:
             from pycallgraph import PyCallGraph
             from pycallgraph.output import GraphvizOutput
@@ -2,5 +2,6 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from .analyzer import *
 from .socket_gen import *
 from .twisted_gen import *
@@ -0,0 +1,182 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+
+class StreamAnalyzer(object):
+    """
+    A RTP media stream health analyzer, every incoming media packet is handled in constant time and memory.
+
+    This analyzer computes the following metrics :
+
+    * RTP sequence gaps (discontinuities), lost, duplicated and reordered packets
+    * Inter-arrival jitter as defined in RFC 3550 (section 6.4.1 and appendix A.8)
+    * Bitrate over a sliding window of ``window`` seconds
+    * MPEG-TS continuity counter and sync byte errors (of the MPEG-TS packets embedded into the RTP payload)
+
+    **Example usage**
+
+    >>> from pytoolbox.network.rtp import RtpPacket
+    >>> analyzer = StreamAnalyzer()
+    >>> for sequence, arrival in ((1, 0.0), (2, 0.01), (2, 0.011), (5, 0.04), (4, 0.041), (6, 0.05)):
+    ...     ts = bytearray([0x47, 0x00, 0x11, 0x10 + sequence]) + bytearray(184)
+    ...     analyzer.put_media(RtpPacket.create(sequence, sequence * 900, RtpPacket.MP2T_PT, ts), 200, arrival)
+    >>> stats = analyzer.stats
+    >>> print(stats['received'], stats['duplicates'], stats['reordered'], stats['gaps'], stats['lost'])
+    6 1 1 1 1
+    >>> print(stats['cc_errors'], stats['sync_errors'], int(stats['bitrate']))
+    3 0 192000
+    """
+
+    #: The clock rate of MPEG-TS over RTP (in Hz)
+    DEFAULT_CLOCK_RATE = 90000
+
+    #: Size of the history used to detect duplicated packets (in packets)
+    HISTORY_SIZE = 1024
+
+    TS_PACKET_SIZE = 188
+    TS_SYNC_BYTE = 0x47
+    TS_NULL_PID = 0x1fff
+
+    def __init__(self, clock_rate=DEFAULT_CLOCK_RATE, window=10):
+        """
+        Construct a StreamAnalyzer.
+
+        :param clock_rate: Clock rate of the RTP timestamps (in Hz)
+        :type clock_rate: int
+        :param window: Duration of the sliding window used to compute the bitrate (in seconds)
+        :type window: int
+        """
+        self.clock_rate = clock_rate
+        self.window = window
+        self.received = self.duplicates = self.reordered = self.gaps = 0
+        self.cc_errors = self.sync_errors = 0
+        self._base_sequence = self._max_sequence = None
+        self._cycles = 0
+        self._history = [None] * self.HISTORY_SIZE
+        self._transit = None
+        self._jitter = 0.0
+        self._buckets = [0] * window
+        self._bucket_index = None
+        self._window_bytes = 0
+        self._first_arrival = self._last_arrival = None
+        self._ts_counters = {}
+
+    @property
+    def expected(self):
+        """Return the number of packets expected from the sequence numbers (RFC 3550, appendix A.3)."""
+        if self._base_sequence is None:
+            return 0
+        return self._cycles + self._max_sequence - self._base_sequence + 1
+
+    @property
+    def lost(self):
+        """Return the cumulative number of packets lost (negative if duplicates are not detected)."""
+        return self.expected - (self.received - self.duplicates)
+
+    @property
+    def jitter(self):
+        """Return the inter-arrival jitter in seconds."""
+        return self._jitter / self.clock_rate
+
+    @property
+    def bitrate(self):
+        """Return the bitrate over the sliding window in bits per second."""
+        if self._first_arrival is None:
+            return 0.0
+        duration = min(self.window, self._last_arrival - self._first_arrival)
+        return self._window_bytes * 8 / duration if duration > 0 else 0.0
+
+    @property
+    def stats(self):
+        """Return a dictionary with the metrics."""
+        return {
+            'received': self.received, 'expected': self.expected, 'lost': self.lost, 'gaps': self.gaps,
+            'duplicates': self.duplicates, 'reordered': self.reordered, 'jitter': self.jitter,
+            'bitrate': self.bitrate, 'cc_errors': self.cc_errors, 'sync_errors': self.sync_errors
+        }
+
+    def put_media(self, media, size, arrival):
+        """
+        Put an incoming media packet.
+
+        :param media: Incoming media packet
+        :type media: RtpPacket
+        :param size: Size of the datagram (in bytes)
+        :type size: int
+        :param arrival: Arrival time of the datagram (in seconds)
+        :type arrival: float
+        """
+        self.received += 1
+        self._put_bitrate(size, arrival)
+        if self._put_sequence(media.sequence):
+            self._put_jitter(media.timestamp, arrival)
+            self._put_ts(media.payload)
+
+    def _put_sequence(self, sequence):
+        """Update the sequence related metrics, returns False if the packet is a duplicate."""
+        history = self._history
+        slot = sequence % self.HISTORY_SIZE
+        if self._base_sequence is None:
+            self._base_sequence = self._max_sequence = sequence
+        else:
+            delta = (sequence - self._max_sequence) & 0xffff
+            if delta == 0 or (delta >= 0x8000 and history[slot] == sequence):
+                self.duplicates += 1
+                return False
+            if delta < 0x8000:
+                if delta > 1:
+                    self.gaps += 1
+                if sequence < self._max_sequence:
+                    self._cycles += 0x10000
+                self._max_sequence = sequence
+            else:
+                self.reordered += 1
+        history[slot] = sequence
+        return True
+
+    def _put_jitter(self, timestamp, arrival):
+        transit = int(arrival * self.clock_rate) - timestamp
+        if self._transit is not None:
+            # Timestamps are 32-bits unsigned, handle the wrap around
+            d = abs(((transit - self._transit) + 0x80000000) % 0x100000000 - 0x80000000)
+            self._jitter += (d - self._jitter) / 16
+        self._transit = transit
+
+    def _put_bitrate(self, size, arrival):
+        index = int(arrival)
+        buckets, window = self._buckets, self.window
+        if self._bucket_index is None:
+            self._first_arrival, self._bucket_index = arrival, index
+        elif index > self._bucket_index:
+            # Expire the buckets that slipped out of the window (at most window buckets)
+            for i in range(self._bucket_index + 1, min(index, self._bucket_index + window) + 1):
+                self._window_bytes -= buckets[i % window]
+                buckets[i % window] = 0
+            self._bucket_index = index
+        buckets[index % window] += size
+        self._window_bytes += size
+        self._last_arrival = arrival
+
+    def _put_ts(self, payload):
+        counters = self._ts_counters
+        for offset in range(0, len(payload) - self.TS_PACKET_SIZE + 1, self.TS_PACKET_SIZE):
+            if payload[offset] != self.TS_SYNC_BYTE:
+                self.sync_errors += 1
+                continue
+            pid = ((payload[offset + 1] & 0x1f) << 8) | payload[offset + 2]
+            if pid == self.TS_NULL_PID:
+                continue
+            flags = payload[offset + 3]
+            counter, has_payload = flags & 0x0f, flags & 0x10
+            # Discontinuity indicator set in the adaptation field
+            if flags & 0x20 and payload[offset + 4] > 0 and payload[offset + 5] & 0x80:
+                counters[pid] = counter
+                continue
+            last = counters.get(pid)
+            if last is not None:
+                expected = (last + 1) & 0x0f if has_payload else last
+                # A packet may be sent twice (same counter), this is not an error
+                if counter != expected and not (has_payload and counter == last):
+                    self.cc_errors += 1
+            counters[pid] = counter
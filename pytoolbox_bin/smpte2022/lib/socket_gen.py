@@ -2,11 +2,15 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import logging, socket, struct, time
-from pytoolbox.encoding import to_bytes
+import json, logging, socket, struct, time
+from codecs import open
+from pytoolbox.encoding import string_types, to_bytes
+from pytoolbox.network.ip import IPSocket
 from pytoolbox.network.rtp import RtpPacket
 from pytoolbox.network.smpte2022.generator import FecGenerator
 
+from .analyzer import StreamAnalyzer
+
 log = logging.getLogger('smpte2022lib')
 
 
@@ -16,6 +20,10 @@ class SocketFecGenerator(object):
     A SMPTE 2022-1 FEC streams generator with network skills based on :mod:`socket`.
 
     This generator listen to incoming RTP media stream, compute and output corresponding FEC streams.
+    Every FEC packet is computed once and then sent to all the column (or row) destinations.
+
+    The matrix size and the destinations can be changed while running (see ``reconfigure()``), the new settings are
+    applied at the next matrix boundary so the FEC streams continue without any reset.
 
     **Example usage**
 
@@ -24,6 +32,8 @@ class SocketFecGenerator(object):
     >>> col = IPSocket(SocketFecGenerator.DEFAULT_COL)
     >>> row = IPSocket(SocketFecGenerator.DEFAULT_ROW)
     >>> generator = SocketFecGenerator(media, col, row, 5, 6)
+    >>> generator.col_sockets == [col] and generator.row_sockets == [row]
+    True
     >>> print(generator._generator)
     Matrix size L x D            = 5 x 6
     Total invalid media packets  = 0
@@ -32,41 +42,78 @@ class SocketFecGenerator(object):
     Row    sequence number       = 1
     Media  sequence number       = None
     Medias buffer (seq. numbers) = []
+
+    Retune the matrix and add a row destination, applied immediately because the generator is not running:
+
+    >>> generator.reconfigure(L=4, D=4, row_sockets=[row, IPSocket('127.0.0.1:5008')])
+    >>> print(generator._generator.L, generator._generator.D, len(generator.row_sockets))
+    4 4 2
     """
 
     DEFAULT_MEDIA = '239.232.0.222:5004'
     DEFAULT_COL = '239.232.0.222:5006'
     DEFAULT_ROW = '239.232.0.222:5008'
 
-    def __init__(self, media_socket, col_socket, row_socket, L, D):
+    def __init__(self, media_socket, col_sockets, row_sockets, L, D, analyzer=None):
         """
         Construct a SocketFecGenerator.
 
         :param media_socket: Socket of incoming RTP media stream
         :type media_socket: IPSocket
-        :param col_socket: Socket of output FEC stream (column)
-        :type col_socket: IPSocket
-        :param row_socket: Socket of output FEC stream (row)
-        :type row_socket: IPSocket
+        :param col_sockets: Socket(s) of output FEC stream (column)
+        :type col_sockets: IPSocket, list
+        :param row_sockets: Socket(s) of output FEC stream (row)
+        :type row_sockets: IPSocket, list
         :param L: Horizontal size of the FEC matrix (columns)
         :type L: int
         :param D: Vertical size of the FEC matrix (rows)
         :type D: int
+        :param analyzer: An optional analyzer of the incoming RTP media stream
+        :type analyzer: StreamAnalyzer
         """
         self.media_socket = media_socket
-        self.col_socket = col_socket
-        self.row_socket = row_socket
+        self.analyzer = analyzer
+        self.col_sockets = to_sockets(col_sockets)
+        self.row_sockets = to_sockets(row_sockets)
         self._generator = FecGenerator(L, D)
         self._generator.on_new_col = self.on_new_col
         self._generator.on_new_row = self.on_new_row
         self._generator.on_reset = self.on_reset
+        self._outgoing = []
+        self._pending_config = None
         self._running = False
+        # A single persistent socket is used to send all the FEC packets (to any destination)
+        self._send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self._send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
 
     @property
     def running(self):
         """Return True if FEC generator is running."""
         return self._running
 
+    @property
+    def stats(self):
+        """
+        Return a dictionary with the statistics of the generator (and of the analyzer, if any).
+
+        **Example usage**
+
+        >>> from pytoolbox.network.ip import IPSocket
+        >>> generator = SocketFecGenerator(IPSocket(SocketFecGenerator.DEFAULT_MEDIA),
+        ...                                IPSocket(SocketFecGenerator.DEFAULT_COL),
+        ...                                IPSocket(SocketFecGenerator.DEFAULT_ROW), 5, 6, analyzer=StreamAnalyzer())
+        >>> sorted(generator.stats)
+        ['analyzer', 'col_sequence', 'invalid', 'received', 'row_sequence']
+        """
+        generator = self._generator
+        stats = {
+            'received': generator._total, 'invalid': generator._invalid,
+            'col_sequence': generator._col_sequence, 'row_sequence': generator._row_sequence
+        }
+        if self.analyzer:
+            stats['analyzer'] = self.analyzer.stats
+        return stats
+
     def run(self, timeout, stop_time=None):
         """
         Run FEC generator main loop.
@@ -102,19 +149,27 @@ class SocketFecGenerator(object):
             mreq = struct.pack(b'4sL', group, socket.INADDR_ANY)
             sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
             sock.settimeout(timeout)  # Time-out must be enabled to react to stop requests
+            analyzer = self.analyzer
             while self._running:      # Receive loop
                 try:
                     datagram, address = sock.recvfrom(1024)
                     media = RtpPacket(bytearray(datagram), len(datagram))
+                    if analyzer:
+                        analyzer.put_media(media, len(datagram), time.time())
                     log.debug('Incoming media packet seq={0} ts={1} psize={2} ssrc={3} address={4}'.format(
                               media.sequence, media.timestamp, media.payload_size, media.ssrc, address))
                     self._generator.put_media(media)
+                    self.flush()
+                    if self._pending_config:
+                        self._apply_config()
                 except socket.timeout:
-                    pass  # Handle time-out by doing nothing more than re-looping
+                    if self._pending_config:
+                        self._apply_config()
                 delta_time = time.time() - start_time
                 if stop_time and delta_time > stop_time:
                     break
             log.info('Stopped listening {0} after {1} seconds'.format(self.media_socket, delta_time))
+            log.info('Statistics: {0}'.format(self.stats))
         finally:
             self.stop()
 
@@ -128,11 +183,71 @@ class SocketFecGenerator(object):
         log.info('\nGenerator stopped\n')
         self._running = False
 
+    def reconfigure(self, L=None, D=None, col_sockets=None, row_sockets=None):
+        """
+        Change the settings of the generator, parameters set to None are left unchanged.
+
+        The new settings are applied by the main loop at the next matrix boundary (immediately if the generator is not
+        running). The sending socket is kept and the FEC algorithm state (sequence numbers) is carried over to the new
+        matrix. This method is safe to call from a signal handler.
+
+        :param L: Horizontal size of the FEC matrix (columns)
+        :type L: int
+        :param D: Vertical size of the FEC matrix (rows)
+        :type D: int
+        :param col_sockets: Socket(s) of output FEC stream (column)
+        :type col_sockets: IPSocket, list
+        :param row_sockets: Socket(s) of output FEC stream (row)
+        :type row_sockets: IPSocket, list
+        """
+        if (L is not None and L < 1) or (D is not None and D < 1):
+            raise ValueError(to_bytes('Matrix size L x D must be at least 1 x 1, got {0} x {1}'.format(L, D)))
+        config = self._pending_config or {}
+        config.update((k, v) for k, v in (('L', L), ('D', D)) if v is not None)
+        if col_sockets is not None:
+            config['col_sockets'] = to_sockets(col_sockets)
+        if row_sockets is not None:
+            config['row_sockets'] = to_sockets(row_sockets)
+        self._pending_config = config
+        if not self._running:
+            self._apply_config()
+
+    def _apply_config(self):
+        """Apply the pending settings if the current matrix is complete (the medias buffer is empty)."""
+        if self._generator._medias:
+            return
+        config, self._pending_config = self._pending_config, None
+        self.col_sockets = config.get('col_sockets', self.col_sockets)
+        self.row_sockets = config.get('row_sockets', self.row_sockets)
+        old = self._generator
+        L, D = config.get('L', old.L), config.get('D', old.D)
+        if (L, D) != (old.L, old.D):
+            new = FecGenerator(L, D)
+            new.on_new_col, new.on_new_row, new.on_reset = old.on_new_col, old.on_new_row, old.on_reset
+            new._col_sequence, new._row_sequence = old._col_sequence, old._row_sequence
+            new._media_sequence, new._invalid, new._total = old._media_sequence, old._invalid, old._total
+            self._generator = new
+        log.info('Generator reconfigured L x D = {0} x {1}, columns to {2}, rows to {3}'.format(
+                 L, D, self.col_sockets, self.row_sockets))
+
+    def flush(self):
+        """
+        Send the FEC packets queued by ``on_new_col()`` and ``on_new_row()`` to their destinations.
+
+        The packets are queued while a media packet is handled by the FEC algorithm (the last media packet of a matrix
+        generates a row and L columns) and then sent in one batch through the persistent sending socket.
+        """
+        outgoing, self._outgoing = self._outgoing, []
+        sendto = self._send_socket.sendto
+        for data, sockets in outgoing:
+            for output_socket in sockets:
+                sendto(data, (output_socket['ip'], output_socket['port']))
+
     def on_new_col(self, col, generator):
         """
         Called by ``self=FecGenerator`` when a new column FEC packet is generated and available for output.
 
-        Send the encapsulated column FEC packet.
+        Queue the encapsulated column FEC packet for output to all the column destinations.
 
         :param col: Generated column FEC packet
         :type col: FecPacket
@@ -141,16 +256,14 @@ class SocketFecGenerator(object):
         """
         col_rtp = RtpPacket.create(col.sequence, 0, RtpPacket.DYNAMIC_PT, col.bytes)
         log.debug('Send COL FEC packet seq={0} snbase={1} LxD={2}x{3} trec={4} socket={5}'.format(
-                  col.sequence, col.snbase, col.L, col.D, col.timestamp_recovery, self.col_socket))
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-        sock.sendto(col_rtp.bytes, (self.col_socket['ip'], self.col_socket['port']))
+                  col.sequence, col.snbase, col.L, col.D, col.timestamp_recovery, self.col_sockets))
+        self._outgoing.append((col_rtp.bytes, self.col_sockets))
 
     def on_new_row(self, row, generator):
         """
         Called by ``self=FecGenerator`` when a new row FEC packet is generated and available for output.
 
-        Send the encapsulated row FEC packet.
+        Queue the encapsulated row FEC packet for output to all the row destinations.
 
         :param row: Generated row FEC packet
         :type row: FecPacket
@@ -159,10 +272,8 @@ class SocketFecGenerator(object):
         """
         row_rtp = RtpPacket.create(row.sequence, 0, RtpPacket.DYNAMIC_PT, row.bytes)
         log.debug('Send ROW FEC packet seq={0} snbase={1} LxD={2}x{3} trec={4} socket={5}'.format(
-                  row.sequence, row.snbase, row.L, row.D, row.timestamp_recovery, self.row_socket))
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-        sock.sendto(row_rtp.bytes, (self.row_socket['ip'], self.row_socket['port']))
+                  row.sequence, row.snbase, row.L, row.D, row.timestamp_recovery, self.row_sockets))
+        self._outgoing.append((row_rtp.bytes, self.row_sockets))
 
     def on_reset(self, media, generator):
         """
@@ -177,3 +288,38 @@ class SocketFecGenerator(object):
         """
         log.warning('Media seq={0} is out of sequence (expected {1}) : FEC algorithm resetted !'.format(
                     media.sequence, generator._media_sequence))
+
+
+def to_sockets(sockets):
+    """
+    Return a list of sockets, ``sockets`` can be a single socket or an iterable of sockets.
+
+    **Example usage**
+
+    >>> to_sockets({'ip': '127.0.0.1', 'port': 5006})
+    [{'ip': '127.0.0.1', 'port': 5006}]
+    >>> len(to_sockets([{'ip': '127.0.0.1', 'port': 5006}, {'ip': '127.0.0.1', 'port': 5008}]))
+    2
+    """
+    return [sockets] if isinstance(sockets, dict) else list(sockets)
+
+
+def load_config(filename):
+    """
+    Load the settings of a :class:`SocketFecGenerator` from a JSON file and return them as ``reconfigure()`` arguments.
+
+    The file may contain any of the keys ``l``, ``d``, ``col`` and ``row`` (sockets as strings, e.g. ``"1.2.3.4:5006"``
+    or lists of them), missing keys are left unchanged.
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        config = json.loads(f.read())
+    unknown_keys = set(config) - set(('l', 'd', 'col', 'row'))
+    if unknown_keys:
+        raise ValueError(to_bytes('Unknown settings {0} in {1}'.format(sorted(unknown_keys), filename)))
+    kwargs = {'L': config.get('l'), 'D': config.get('d')}
+    for key in ('col', 'row'):
+        if key in config:
+            sockets = config[key]
+            sockets = [sockets] if isinstance(sockets, string_types) else sockets
+            kwargs[key + '_sockets'] = [IPSocket(s) for s in sockets]
+    return kwargs
@@ -2,13 +2,20 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import json, logging
-from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, FileType
-from codecs import open
+import json, logging, os
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from pytoolbox.datetime import datetime_now
 from pytoolbox.encoding import configure_unicode
 from pytoolbox.logging import setup_logging
 
-from .lib import graph, measure
+from .engine import HttpEngine
+from .lib import graph, measure, tespeed
+from .probes import Prober
+from .stats import compute_stats, format_table, load_columns
+from .store import ColumnarStore, JsonLinesStore, convert
+from .targets import load_targets
+
+log = logging.getLogger('isp_benchmark')
 
 
 def isp_benchmark():
@@ -17,11 +24,30 @@ def isp_benchmark():
     configure_unicode()
     setup_logging(name='isp_benchmark', filename=None, console=True, level=logging.DEBUG)
 
-    HELP_F = 'The path to a file with the results of a benchmark'
+    HELP_C = 'Convert JSON (lines) results to the columnar format'
+    HELP_CD = 'The path to the columnar results directory to create (or append to)'
+    HELP_D = 'Duration of the download and of the upload measures of the http engine, in seconds'
+    HELP_E = 'Engine used to measure the speed: the tespeed command or the built-in http engine'
+    HELP_F = 'The path to a file (or columnar directory) with the results of a benchmark'
+    HELP_FC = 'Render the charts even if they are up to date with the results'
+    HELP_FO = 'Format of the results: JSON lines or columnar (directory of memory-mappable arrays)'
     HELP_G = 'Graph the results into a png and svg file'
     HELP_I = 'Interval for the measures, in minutes'
+    HELP_J = 'Output the statistics as JSON'
     HELP_M = 'Run the benchmark and save results into a json file'
+    HELP_O = 'Results file (or directory), appended as the measures complete, resume the run if it exists'
+    HELP_P = 'Target of latency probes sent during and between the measures (tcp://host:port or udp://host:port)'
+    HELP_PR = 'Number of latency probes per second (per target)'
     HELP_R = 'Time range to measure, in minutes'
+    HELP_S = 'Number of parallel streams of the http engine'
+    HELP_SL = 'Count the measures with a download speed below this threshold, in Mbps'
+    HELP_ST = 'Compute the percentiles of the speeds per hour of day and day of week, the SLA breaches, ...'
+    HELP_T = 'Timeout of a measure, in seconds (defaults to the interval)'
+    HELP_TA = 'JSON file describing the targets to measure (overrides the engine and probe options)'
+    HELP_TN = 'Compute the statistics of the results of this target (multi-targets mode)'
+    HELP_U = 'URL of a large resource to download with the http engine'
+    HELP_UU = 'URL accepting large uploads (POST) with the http engine, defaults to the download URL'
+    HELP_W = 'Size of the window of the rolling median, in measures'
 
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, epilog=isp_benchmark.__doc__)
     subparsers = parser.add_subparsers(dest='action', help=isp_benchmark.__doc__)
@@ -30,24 +56,66 @@ def isp_benchmark():
     measure_parser.add_argument('-i', '--interval', type=int, help=HELP_I, default=15)
     measure_parser.add_argument('-r', '--range',    type=int, help=HELP_R, default=24*60)
     measure_parser.add_argument('-g', '--graph',    action='store_true', help=HELP_G)
+    measure_parser.add_argument('-o', '--output',   help=HELP_O, default=None)
+    measure_parser.add_argument('-f', '--format',   choices=('jsonl', 'columnar'), help=HELP_FO, default='jsonl')
+    measure_parser.add_argument('-t', '--timeout',  type=int, help=HELP_T, default=None)
+    measure_parser.add_argument('-n', '--engine',   choices=('tespeed', 'http'), help=HELP_E, default='tespeed')
+    measure_parser.add_argument('-u', '--url',      help=HELP_U, default=None)
+    measure_parser.add_argument('--upload-url',     help=HELP_UU, default=None)
+    measure_parser.add_argument('-s', '--streams',  type=int, help=HELP_S, default=4)
+    measure_parser.add_argument('-d', '--duration', type=int, help=HELP_D, default=10)
+    measure_parser.add_argument('-p', '--probe',    action='append', help=HELP_P, default=[])
+    measure_parser.add_argument('--probe-rate',     type=float, help=HELP_PR, default=10)
+    measure_parser.add_argument('-T', '--targets',  help=HELP_TA, default=None)
 
     graph_parser = subparsers.add_parser('graph',  help=HELP_G)
-    graph_parser.add_argument('results_file', type=FileType('r'), help=HELP_F)
+    graph_parser.add_argument('results_file', help=HELP_F)
+
+    convert_parser = subparsers.add_parser('convert', help=HELP_C)
+    convert_parser.add_argument('results_file', help=HELP_F)
+    convert_parser.add_argument('columnar_directory', help=HELP_CD)
+
+    stats_parser = subparsers.add_parser('stats', help=HELP_ST)
+    stats_parser.add_argument('results_file', help=HELP_F)
+    stats_parser.add_argument('-l', '--sla',    type=float, help=HELP_SL, default=None)
+    stats_parser.add_argument('-W', '--window', type=int, help=HELP_W, default=96)
+    stats_parser.add_argument('-j', '--json',   action='store_true', help=HELP_J)
+    stats_parser.add_argument('-T', '--target', help=HELP_TN, default=None)
 
     for p in (measure_parser, graph_parser):
         p.add_argument('-w', '--width',  type=int, default=1920)
         p.add_argument('-e', '--height', type=int, default=1080)
+        p.add_argument('--force',        action='store_true', help=HELP_FC)
 
     args = parser.parse_args()
 
     if args.action == 'measure':
-        results = measure(args.interval * 60, args.range * 60)
-        if results:
-            filename = 'isp-benchmark %s.json' % results[0]['date']
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(json.dumps(results))
-            if args.graph:
-                graph(open(filename, 'r'), width=args.width, height=args.height)
+        engine = tespeed
+        targets = load_targets(args.targets) if args.targets else None
+        if args.engine == 'http' and not targets:
+            if not args.url:
+                parser.error('The http engine requires an URL (--url).')
+            engine = HttpEngine(args.url, args.upload_url, streams=args.streams, duration=args.duration)
+        prober = Prober(args.probe, rate=args.probe_rate) if args.probe else None
+        store_class, extension = (ColumnarStore, 'isp') if args.format == 'columnar' else (JsonLinesStore, 'jsonl')
+        filename = args.output or 'isp-benchmark %s.%s' % (datetime_now(), extension)
+        with store_class(filename) as store:
+            counter = len(store) if os.path.exists(filename) else 0
+            if counter:
+                log.info('Resume run of {0} with {1} results'.format(filename, counter))
+            measure(args.interval * 60, args.range * 60, store, counter=counter, timeout=args.timeout, engine=engine,
+                    prober=prober, targets=targets)
+        if args.graph and os.path.exists(filename):
+            graph(filename, width=args.width, height=args.height, cache=not args.force)
 
     elif args.action == 'graph':
-        graph(args.results_file, width=args.width, height=args.height)
+        graph(args.results_file, width=args.width, height=args.height, cache=not args.force)
+
+    elif args.action == 'convert':
+        count = convert(args.results_file, args.columnar_directory)
+        log.info('Converted {0} results into {1}'.format(count, args.columnar_directory))
+
+    elif args.action == 'stats':
+        keys = tuple(('%s %s' % (args.target, k) if args.target else k) for k in ('download', 'upload'))
+        stats = compute_stats(load_columns(args.results_file, keys), sla=args.sla, window=args.window, keys=keys)
+        print(json.dumps(stats, indent=2, sort_keys=True) if args.json else format_table(stats, keys))
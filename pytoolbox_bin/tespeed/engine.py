@@ -0,0 +1,237 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging, threading, time
+from http.client import HTTPConnection, HTTPSConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pytoolbox.datetime import datetime_now
+from urllib.parse import urlsplit
+
+log = logging.getLogger('isp_benchmark')
+
+
+class HttpEngine(object):
+    """
+    A throughput measurement engine downloading from and uploading to an HTTP endpoint with parallel streams.
+
+    Every stream counts the bytes transferred into time slices, the goodput is computed from the slices following the
+    warm-up period (TCP slow start). The result is a dictionary like the one returned by
+    :func:`pytoolbox_bin.tespeed.lib.tespeed`.
+
+    **Example usage**
+
+    >>> with SpeedTestServer() as server:
+    ...     engine = HttpEngine(server.url, streams=2, duration=0.6, warmup=0.2)
+    ...     result = engine(timeout=5)
+    >>> result['download'] > 0 and result['upload'] > 0
+    True
+    >>> sorted(result)
+    ['date', 'download', 'upload']
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    UPLOAD_SIZE = 1024 ** 4  # Announced size of the upload, the request is interrupted once the duration elapsed
+
+    def __init__(self, download_url, upload_url=None, streams=4, duration=10, slice_duration=0.5, warmup=None):
+        """
+        Construct a HttpEngine.
+
+        :param download_url: URL of a large resource to download (GET)
+        :type download_url: str
+        :param upload_url: URL accepting large uploads (POST), defaults to `download_url`
+        :type upload_url: str
+        :param streams: Number of parallel streams (connections) per direction
+        :type streams: int
+        :param duration: Duration of the measure of every direction (in seconds)
+        :type duration: float
+        :param slice_duration: Duration of a time slice (in seconds)
+        :type slice_duration: float
+        :param warmup: Duration of the warm-up period not taken into account (in seconds), defaults to a fifth of the
+                       duration and at most 2 seconds
+        :type warmup: float
+        """
+        if warmup is None:
+            warmup = min(2, duration / 5)
+        if int(warmup / slice_duration) >= int(round(duration / slice_duration)):
+            raise ValueError('Warm-up ({0}) must end before the last time slice of the duration ({1})'.format(
+                             warmup, duration))
+        self.download_url = download_url
+        self.upload_url = upload_url or download_url
+        self.streams = streams
+        self.duration = duration
+        self.slice_duration = slice_duration
+        self.warmup = warmup
+
+    def __call__(self, timeout=None):
+        """
+        Measure the download and upload speed (in Mbps), return None if the measure failed.
+
+        The streams are bounded by the duration, `timeout` is applied to the socket operations (defaults to duration).
+        """
+        timeout = timeout or self.duration
+        try:
+            date_ = datetime_now()
+            download = self.goodput(self.run(self.download_worker, self.download_url, timeout))
+            upload = self.goodput(self.run(self.upload_worker, self.upload_url, timeout))
+            return {'date': date_, 'download': download, 'upload': upload}
+        except Exception as e:
+            log.warning('Measure failed, reason: {0}'.format(repr(e)))
+            return None
+
+    def goodput(self, slices):
+        """
+        Return the goodput (in Mbps) computed from the bytes transferred during the slices after the warm-up.
+
+        **Example usage**
+
+        >>> engine = HttpEngine('http://localhost/', duration=2, slice_duration=0.5, warmup=1)
+        >>> engine.goodput([0, 0, 125000, 250000])
+        3.0
+        >>> HttpEngine('http://localhost/', duration=0.6, slice_duration=0.5, warmup=0.5)
+        Traceback (most recent call last):
+            ...
+        ValueError: Warm-up (0.5) must end before the last time slice of the duration (0.6)
+        """
+        first = int(self.warmup / self.slice_duration)
+        slices = slices[first:]
+        return sum(slices) * 8 / (len(slices) * self.slice_duration) / 1e6
+
+    def run(self, worker, url, timeout):
+        """Run the streams in parallel and return the number of bytes transferred per time slice (all streams)."""
+        start_time = time.monotonic()
+        deadline = start_time + self.duration
+        counters = [[0] * int(round(self.duration / self.slice_duration)) for i in range(self.streams)]
+        errors = []
+
+        def run_worker(counter):
+            try:
+                worker(urlsplit(url), start_time, deadline, counter, timeout)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run_worker, args=(c, )) for c in counters]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(errors) == len(threads):
+            raise errors[0]
+        for error in errors:
+            log.warning('Stream failed, reason: {0}'.format(repr(error)))
+        return [sum(s) for s in zip(*counters)]
+
+    def count(self, counter, start_time, size):
+        """Add `size` bytes to the current time slice of `counter`, return False once the duration elapsed."""
+        index = int((time.monotonic() - start_time) / self.slice_duration)
+        if index >= len(counter):
+            return False
+        counter[index] += size
+        return True
+
+    def download_worker(self, url, start_time, deadline, counter, timeout):
+        connection = connect(url, timeout)
+        try:
+            while time.monotonic() < deadline:
+                connection.request('GET', request_path(url))
+                response = connection.getresponse()
+                if response.status != 200:
+                    raise IOError('Unexpected status {0} {1}'.format(response.status, response.reason))
+                while True:
+                    data = response.read(self.CHUNK_SIZE)
+                    if not data or not self.count(counter, start_time, len(data)):
+                        break
+                if data:
+                    return  # Duration elapsed in the middle of the response
+        finally:
+            connection.close()
+
+    def upload_worker(self, url, start_time, deadline, counter, timeout):
+        chunk = b'\0' * self.CHUNK_SIZE
+        connection = connect(url, timeout)
+        try:
+            connection.putrequest('POST', request_path(url))
+            connection.putheader('Content-Type', 'application/octet-stream')
+            connection.putheader('Content-Length', str(self.UPLOAD_SIZE))
+            connection.endheaders()
+            while True:
+                connection.send(chunk)
+                if not self.count(counter, start_time, len(chunk)):
+                    break
+        finally:
+            connection.close()
+
+
+class SpeedTestServer(object):
+    """
+    A local HTTP server standing in for a speed test endpoint, useful to test :class:`HttpEngine`.
+
+    GET requests are answered with `size` null bytes and POST requests bodies are read and discarded.
+    """
+
+    def __init__(self, address='127.0.0.1', port=0, size=10 * 1024 * 1024):
+        chunk = b'\0' * HttpEngine.CHUNK_SIZE
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(size))
+                self.end_headers()
+                remaining = size
+                while remaining > 0:
+                    self.wfile.write(chunk[:remaining])
+                    remaining -= len(chunk)
+
+            def do_POST(self):
+                remaining = int(self.headers.get('Content-Length', 0))
+                while remaining > 0:
+                    data = self.rfile.read(min(remaining, len(chunk)))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _SpeedTestHTTPServer((address, port), Handler)
+        self.url = 'http://{0}:{1}/'.format(*self.server.server_address)
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+class _SpeedTestHTTPServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # The clients interrupt the transfers once the duration elapsed
+
+
+def connect(url, timeout):
+    connection_class = HTTPSConnection if url.scheme == 'https' else HTTPConnection
+    return connection_class(url.hostname, url.port, timeout=timeout)
+
+
+def request_path(url):
+    return (url.path or '/') + ('?' + url.query if url.query else '')
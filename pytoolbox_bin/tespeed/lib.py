@@ -2,69 +2,384 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import json, logging, os, pygal, re, time
+import hashlib, json, logging, numpy, os, pygal, re, threading, time
+from codecs import open
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pytoolbox.datetime import datetime_now
-from subprocess import check_output
+from subprocess import check_output, TimeoutExpired
+
+from .store import ColumnarStore, format_date, is_speed, open_results
 
 log = logging.getLogger('isp_benchmark')
 
+#: Bump it when the charts change, this invalidates the charts rendered by a previous version
+GRAPH_VERSION = 2
+
 TESPEED_CSV_REGEX = re.compile(r'(?P<download>\d+\.?\d*),(?P<upload>\d+\.?\d*),"Mbit","[^"]+"')
 
 
-def tespeed():
+def tespeed(timeout=None):
+    """Measure the speed with tespeed, the process is killed if it does not complete within `timeout` seconds."""
     result = None
     try:
         date_ = datetime_now()
-        match = TESPEED_CSV_REGEX.match(check_output(['tespeed', '-sw']))
+        match = TESPEED_CSV_REGEX.match(check_output(['tespeed', '-sw'], timeout=timeout).decode('utf-8'))
         if match:
             result = {k: float(v) for k, v in match.groupdict().items()}
             result.update({'date': date_})
+    except TimeoutExpired:
+        log.warning('Measure killed, it did not complete within {0} seconds.'.format(timeout))
     except Exception:
         pass
     return result
 
 
-def graph(results_file, width=1920, height=1080):
-    name = os.path.splitext(results_file.name)[0]
-    results = sorted(json.loads(results_file.read()), key=lambda x: x['date'])
+def graph(results_path, width=1920, height=1080, points=None, cache=True):
+    """
+    Graph the results into a PNG and a SVG file.
+
+    The results are downsampled to `points` points per series (defaults to half of the `width`), so the rendering time
+    depends on the size of the chart, not on the number of results. JSON files are streamed twice (statistics then
+    downsampling) and columnar stores are memory-mapped and processed with vectorized operations.
+
+    The 95th percentile of the round-trip times of the probes (if any) are graphed on the secondary axis.
+
+    Both files are rendered in parallel by a pool of processes. The hash of the results and of the options is saved into
+    a sidecar file (``<name>.graph.json``), the rendering is skipped if the charts are up to date (unless `cache` is
+    False).
+
+    Return True if the charts were rendered.
+    """
+    name = os.path.splitext(results_path.rstrip(os.sep))[0]
+    paths = {'png': name + '.png', 'svg': name + '.svg'}
+    cache_path = name + '.graph.json'
+    key = {'version': GRAPH_VERSION, 'results': results_digest(results_path), 'width': width, 'height': height,
+           'points': points}
+    if cache and all(os.path.exists(p) for p in paths.values()) and read_graph_cache(cache_path) == key:
+        log.info('Charts of {0} are up to date'.format(results_path))
+        return False
+
+    buckets = (points or width // 2) // 2
+    results = open_results(results_path)
+    if isinstance(results, ColumnarStore):
+        columns = results.columns()
+        summary = summarize_columns(columns)
+        if summary['count']:
+            series = downsample_columns(columns, summary['first'], summary['last'], buckets, summary['keys'])
+    else:
+        summary = summarize_points(results.iter_points())
+        if summary['count']:
+            series = downsample(results.iter_points(), summary['first'], summary['last'], buckets, summary['keys'])
+    if not summary['count']:
+        log.warning('No results to graph in {0}'.format(results_path))
+        return False
 
-    dates = [r['date'] for r in results]
-    downloads, uploads = [r['download'] for r in results], [r['upload'] for r in results]
-    downloads_with_labels = [{'value': r['download'], 'label': r['date']} for r in results]
-    uploads_with_labels = [{'value': r['upload'], 'label': r['date']} for r in results]
+    first, last, sums, counts = summary['first'], summary['last'], summary['sums'], summary['counts']
+    # The speeds of the targets overlaid, the speeds of the results without a target first
+    speeds = sorted(sums, key=lambda k: (k.rsplit(' ', 1)[0] if ' ' in k else '', k))
+    chart = {
+        'width': width, 'height': height, 'maximum': summary['maximum'],
+        'title': 'Internet access speed %s - %s' % (format_date(first), format_date(last)),
+        'x_labels': [format_date(first), format_date(last)],
+        'series': [
+            ('%s (%0.1f)' % (k if ' ' in k else k.capitalize(), sums[k] / counts[k]), series[k], False) for k in speeds
+        ] + [('RTT p95 %s [ms]' % k, series[k], True) for k in sorted(summary['keys'] - set(sums))]
+    }
+    with ProcessPoolExecutor(max_workers=len(paths)) as executor:
+        for future in [executor.submit(render_chart, chart, f, p) for f, p in paths.items()]:
+            future.result()
+    write_graph_cache(cache_path, key)
+    return True
 
-    chart = pygal.Line(width=width, height=height, order_min=0, y_title='Speed [Mbps]', range=(0, max(downloads)))
-    chart.title = 'Internet access speed %s - %s' % (dates[0], dates[-1])
-    chart.x_labels = [r for i, r in enumerate(dates) if i in (0, len(dates) - 1)]
-    chart.add('Dowload (%0.1f)' % (sum(downloads) / len(downloads)), downloads_with_labels)
-    chart.add('Upload (%0.1f)' % (sum(uploads) / len(uploads)),  uploads_with_labels)
-    chart.render_to_png(name + '.png')
-    chart.render_to_file(name + '.svg')
 
+def render_chart(chart, file_format, path):
+    """Render the `chart` (a dictionary, see :func:`graph`) into `path` with pygal, `file_format` is png or svg."""
+    line = pygal.Line(width=chart['width'], height=chart['height'], order_min=0, y_title='Speed [Mbps]',
+                      range=(0, chart['maximum']))
+    line.title = chart['title']
+    line.x_labels = chart['x_labels']
+    for title, values, secondary in chart['series']:
+        line.add(title, values, secondary=secondary)
+    if file_format == 'png':
+        line.render_to_png(path)
+    else:
+        line.render_to_file(path)
 
-def measure(time_interval, time_range):
-    start_time = time.time()
-    results = []
+
+def results_digest(results_path, chunk_size=1024 * 1024):
+    """
+    Return the SHA-1 hex digest of the content of the results (a file or the files of a columnar store).
+
+    **Example usage**
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> with open(os.path.join(directory, 'a.jsonl'), 'w') as f:
+    ...     print('{"download": 1}', file=f)
+    >>> print(results_digest(os.path.join(directory, 'a.jsonl')))
+    783107380275008ce61c5da9b216e9794006eb74
+    """
+    digest = hashlib.sha1()
+    if os.path.isdir(results_path):
+        filenames = [os.path.join(results_path, f) for f in sorted(os.listdir(results_path))]
+    else:
+        filenames = [results_path]
+    for filename in filenames:
+        digest.update(os.path.basename(filename).encode('utf-8') + b'\0')
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_graph_cache(path):
     try:
-        while True:
-            counter = len(results) + 1
-            time_zero = time.time()
-            result = tespeed()  # {'date': datetime_now(), 'download': 100, 'upload': 10}
-            result_date = result['date'] if result else datetime_now()
-            log_prefix = '[%d/%d at %s] ' % (counter, time_range // time_interval + 1, result_date)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.loads(f.read())
+    except (IOError, ValueError):
+        return None
+
+
+def write_graph_cache(path, key):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(key, sort_keys=True))
+
+
+def iter_points(results_path):
+    """Yield the results stored into `results_path` (any format) as (timestamp, values), see :func:`store.flatten`."""
+    return open_results(results_path).iter_points()
+
+
+def summarize_points(points):
+    """
+    Return the number of points, the time range, the keys, the sums and counts of the speeds and the maximum speed.
+
+    **Example usage**
+
+    >>> summary = summarize_points([(0, {'download': 10, 'upload': 1}), (60, {'lte download': 4, 'lte upload': 2})])
+    >>> print(summary['count'], summary['last'], summary['maximum'], sorted(summary['sums'].items()))
+    2 60 10 [('download', 10), ('lte download', 4), ('lte upload', 2), ('upload', 1)]
+    """
+    summary = {'count': 0, 'first': None, 'last': None, 'keys': set(), 'sums': {}, 'counts': {}, 'maximum': 0}
+    sums, counts = summary['sums'], summary['counts']
+    for timestamp, values in points:
+        summary['count'] += 1
+        summary['first'] = timestamp if summary['first'] is None else min(summary['first'], timestamp)
+        summary['last'] = timestamp if summary['last'] is None else max(summary['last'], timestamp)
+        summary['keys'].update(values)
+        for key, value in values.items():
+            if is_speed(key):
+                sums[key] = sums.get(key, 0) + value
+                counts[key] = counts.get(key, 0) + 1
+                summary['maximum'] = max(summary['maximum'], value)
+    return summary
+
+
+def summarize_columns(columns):
+    """Return the same summary as :func:`summarize_points` from the columns of a :class:`ColumnarStore`."""
+    dates = columns['date']
+    if not len(dates):
+        return {'count': 0}
+    keys = set(k for k, c in columns.items() if k != 'date' and not numpy.isnan(c).all())
+    speeds = [k for k in keys if is_speed(k)]
+    return {
+        'count': len(dates), 'first': int(dates.min()), 'last': int(dates.max()), 'keys': keys,
+        'sums': {k: float(numpy.nansum(columns[k], dtype=numpy.float64)) for k in speeds},
+        'counts': {k: int(numpy.count_nonzero(~numpy.isnan(columns[k]))) for k in speeds},
+        'maximum': max(float(numpy.nanmax(columns[k])) for k in speeds) if speeds else 0
+    }
+
+
+def downsample(points, start, end, buckets, keys):
+    """
+    Downsample `points` (an iterable of timestamp, result) into `buckets` time buckets spread over `start` to `end`.
+
+    The minimum and the maximum of every bucket are kept (in chronological order) so the dips and the spikes are still
+    visible. The points can be in any order and only the buckets are kept in memory. Return a dictionary with, for every
+    key, a list of pygal values with the date as label.
+
+    **Example usage**
+
+    >>> points = [(t, {'download': d}) for t, d in enumerate([10, 11, 2, 12, 10, 11, 10, 10, 15])]
+    >>> series = downsample(reversed(points), 0, 8, 3, ['download'])
+    >>> [value['value'] for value in series['download']]
+    [11, 2, 12, 10, 10, 15]
+    >>> print(series['download'][1]['label'])
+    1970-01-01 00:00:02
+    """
+    span = max(end - start, 1)
+    counts, extrema = {}, {}
+    for timestamp, result in points:
+        index = min(int((timestamp - start) * buckets / span), buckets - 1)
+        counts[index] = counts.get(index, 0) + 1
+        for key in keys:
+            value = result.get(key)
+            if value is None:
+                continue
+            bucket = extrema.setdefault((index, key), [timestamp, value, timestamp, value])
+            if value < bucket[1]:
+                bucket[0:2] = timestamp, value
+            if value > bucket[3]:
+                bucket[2:4] = timestamp, value
+    return buckets_to_series(counts, extrema, keys)
+
+
+def downsample_columns(columns, start, end, buckets, keys):
+    """
+    Vectorized version of :func:`downsample` working on the columns of a :class:`ColumnarStore`.
+
+    **Example usage**
+
+    >>> columns = {'date': numpy.arange(9), 'download': numpy.array([10, 11, 2, 12, 10, 11, 10, 10, 15], 'f4')}
+    >>> [value['value'] for value in downsample_columns(columns, 0, 8, 3, ['download'])['download']]
+    [11.0, 2.0, 12.0, 10.0, 10.0, 15.0]
+    """
+    dates = numpy.asarray(columns['date'])
+    indexes = numpy.minimum((dates - start) * buckets // max(end - start, 1), buckets - 1)
+    counts = numpy.bincount(indexes, minlength=buckets)
+    counts = {int(i): int(counts[i]) for i in numpy.flatnonzero(counts)}
+    extrema = {}
+    for key in keys:
+        values = numpy.asarray(columns[key])
+        valid = numpy.flatnonzero(~numpy.isnan(values))
+        if not len(valid):
+            continue
+        # Sort by bucket then by value, the first and last item of every bucket are the minimum and maximum
+        order = valid[numpy.lexsort((values[valid], indexes[valid]))]
+        sorted_indexes = indexes[order]
+        firsts = numpy.flatnonzero(numpy.r_[True, sorted_indexes[1:] != sorted_indexes[:-1]])
+        lasts = numpy.r_[firsts[1:], len(order)] - 1
+        for index, low, high in zip(sorted_indexes[firsts].tolist(), order[firsts], order[lasts]):
+            extrema[(index, key)] = [int(dates[low]), float(values[low]), int(dates[high]), float(values[high])]
+    return buckets_to_series(counts, extrema, keys)
+
+
+def buckets_to_series(counts, extrema, keys):
+    """Return the series (see :func:`downsample`) of the buckets, `extrema` maps (bucket, key) to min/max points."""
+    series = {key: [] for key in keys}
+    for index in sorted(counts):
+        size = min(counts[index], 2)
+        for key in keys:
+            bucket = extrema.get((index, key))
+            if bucket is None:
+                series[key].extend([None] * size)
+            else:
+                values = sorted([(bucket[0], bucket[1]), (bucket[2], bucket[3])])[2 - size:]
+                series[key].extend({'value': v, 'label': format_date(t)} for t, v in values)
+    return series
+
+
+class Target(object):
+    """
+    A target of the measures: the engine measuring the speed and the (optional) prober measuring the latency.
+
+    The results of a named target are tagged with its name (key ``target``), see :func:`store.flatten`.
+    """
+
+    def __init__(self, name=None, engine=tespeed, prober=None):
+        self.name = name
+        self.engine = engine
+        self.prober = prober
+
+    def __repr__(self):
+        return 'Target({0!r})'.format(self.name)
+
+
+def measure(time_interval, time_range, store, counter=0, timeout=None, engine=tespeed, prober=None, targets=None):
+    """
+    Measure the speed every `time_interval` seconds during `time_range` seconds and append the results to `store`.
+
+    The speed is measured by calling `engine` with the `timeout` keyword argument, see :func:`tespeed` and
+    :class:`pytoolbox_bin.tespeed.engine.HttpEngine`.
+
+    If set, the `prober` (see :class:`pytoolbox_bin.tespeed.probes.Prober`) runs during the whole run and the statistics
+    of the probes sent since the previous measure are stored into the result (key ``latency``).
+
+    Set `targets` (a list of :class:`Target`) to measure several targets, `engine` and `prober` are then ignored. Every
+    slot measures all the targets, the order is rotated from slot to slot so a slow target does not starve the others.
+    The probers of all the targets run concurrently during the whole run.
+
+    The measures are started at absolute deadlines computed with the monotonic clock and run in a thread pool, a measure
+    that lasts longer than the interval does not delay the next one and a measure is killed after `timeout` seconds
+    (defaults to `time_interval`). Slots missed (e.g. the computer was suspended) are skipped.
+
+    The measures of several targets are run one after the other by a single worker thread instead, the throughput
+    measures of the targets never overlap (they would interfere with each other). A measure that cannot start before
+    the end of its slot is skipped.
+
+    Return the number of successful measures. Set `counter` to the number of results already stored to resume a run.
+    """
+    timeout = timeout or time_interval
+    targets = targets or [Target(engine=engine, prober=prober)]
+    slots = int(time_range // time_interval) + 1
+    total = counter + slots * len(targets)
+    multiple = len(targets) > 1
+    lock = threading.Lock()
+    measures = [0]
+
+    def measure_one(counter, target, deadline):
+        name = ' %s' % target.name if target.name else ''
+        if deadline is not None and time.monotonic() > deadline:
+            log.warning('[%d/%d%s] Skip measure, the previous measures lasted too long.' % (counter, total, name))
+            return
+        if target.prober:
+            with target.prober.loaded():
+                result = target.engine(timeout=timeout)
+        else:
+            result = target.engine(timeout=timeout)  # {'date': datetime_now(), 'download': 100, 'upload': 10}
+        if result:
+            if target.prober:
+                result['latency'] = target.prober.snapshot()
+            if target.name:
+                result['target'] = target.name
+        with lock:
+            log_prefix = '[%d/%d%s at %s] ' % (counter, total, name, result['date'] if result else datetime_now())
             if result:
                 log.info(log_prefix + 'Download: {download} Mbps, upload: {upload} Mbps'.format(**result))
-                results.append(result)
+                store.append(result)
+                measures[0] += 1
             else:
                 log.warning(log_prefix + 'Unable to measure speed.')
-            delta_time = time.time() - start_time
-            if delta_time > time_range:
-                break
-            sleep_time = max(0, time_interval - (time.time() - time_zero))
-            log.info(log_prefix + 'Sleeping %0.1f seconds ...' % sleep_time)
-            time.sleep(sleep_time)
+
+    if multiple:
+        # A single worker, the measures are serialized and the queued ones are skipped if they are late
+        executor = ThreadPoolExecutor(max_workers=1)
+    else:
+        # Measures may overlap if they last longer than the interval, the timeout ensures they will not pile up
+        executor = ThreadPoolExecutor(max_workers=int(timeout // time_interval) + 1)
+    probers = [t.prober for t in targets if t.prober]
+    for prober in probers:
+        prober.start()
+    start_time = time.monotonic()
+    try:
+        slot = 0
+        while slot < slots:
+            delay = start_time + slot * time_interval - time.monotonic()
+            if delay > 0:
+                log.info('Next measure in %0.1f seconds ...' % delay)
+                time.sleep(delay)
+            elif delay < -time_interval:
+                skipped = int(-delay // time_interval)
+                log.warning('Skip {0} measures, the schedule is late of {1:0.1f} seconds.'.format(skipped, -delay))
+                slot += skipped
+                continue
+            deadline = start_time + (slot + 1) * time_interval if multiple else None
+            shift = slot % len(targets)
+            for target in targets[shift:] + targets[:shift]:
+                counter += 1
+                executor.submit(measure_one, counter, target, deadline).add_done_callback(log_failure)
+            slot += 1
     except Exception as e:
         log.exception(e)
     except KeyboardInterrupt as e:
         log.warning('Operation aborted by user.')
-    return results
+    finally:
+        executor.shutdown(wait=True)
+        for prober in probers:
+            prober.stop()
+    return measures[0]
+
+
+def log_failure(future):
+    if future.exception():
+        log.error('Measure failed, reason: {0}'.format(repr(future.exception())))
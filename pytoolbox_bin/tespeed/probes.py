@@ -0,0 +1,282 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import contextlib, errno, logging, select, socket, struct, threading, time
+from urllib.parse import urlsplit
+
+log = logging.getLogger('isp_benchmark')
+
+
+class P2Quantile(object):
+    """
+    Streaming estimation of a quantile in constant memory with the P² algorithm (Jain & Chlamtac, 1985).
+
+    **Example usage**
+
+    >>> import random
+    >>> random.seed(1)
+    >>> estimator = P2Quantile(0.9)
+    >>> for i in range(10000):
+    ...     estimator.add(random.random() * 100)
+    >>> 88 < estimator.value < 92
+    True
+    >>> estimator = P2Quantile(0.5)
+    >>> for value in (3, 1, 2):
+    ...     estimator.add(value)
+    >>> estimator.value
+    2
+    """
+
+    def __init__(self, q):
+        self.q = q
+        self.count = 0
+        self._heights = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self._increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    @property
+    def value(self):
+        """Return the estimated quantile (None if no values were added)."""
+        if self.count >= 5:
+            return self._heights[2]
+        if not self._heights:
+            return None
+        heights = sorted(self._heights)
+        return heights[min(int(self.q * len(heights)), len(heights) - 1)]
+
+    def add(self, value):
+        self.count += 1
+        heights, positions, desired = self._heights, self._positions, self._desired
+        if self.count <= 5:
+            heights.append(value)
+            if self.count == 5:
+                heights.sort()
+            return
+        if value < heights[0]:
+            heights[0], k = value, 0
+        elif value >= heights[4]:
+            heights[4], k = value, 3
+        else:
+            k = next(i for i in range(1, 5) if value < heights[i]) - 1
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            desired[i] += self._increments[i]
+        for i in range(1, 4):
+            d = desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i, d):
+        h, n = self._heights, self._positions
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+
+
+class LatencyStats(object):
+    """
+    Round-trip times, jitter and loss of a series of probes, computed in constant memory.
+
+    The jitter is the smoothed mean deviation of consecutive round-trip times (in the spirit of RFC 3550).
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self):
+        self.sent = self.received = 0
+        self.minimum = self.maximum = self.last = None
+        self.jitter = 0.0
+        self._quantiles = [P2Quantile(q) for q in self.QUANTILES]
+
+    def add(self, rtt):
+        """Add the round-trip time of a probe (in seconds), None if the probe is lost."""
+        self.sent += 1
+        if rtt is None:
+            return
+        self.received += 1
+        self.minimum = rtt if self.minimum is None else min(self.minimum, rtt)
+        self.maximum = rtt if self.maximum is None else max(self.maximum, rtt)
+        if self.last is not None:
+            self.jitter += (abs(rtt - self.last) - self.jitter) / 16
+        self.last = rtt
+        for quantile in self._quantiles:
+            quantile.add(rtt)
+
+    @property
+    def stats(self):
+        """Return a dictionary with the statistics, times are in milliseconds."""
+        ms = lambda value: None if value is None else round(value * 1000, 3)
+        stats = {
+            'sent': self.sent, 'received': self.received,
+            'loss': (self.sent - self.received) / self.sent if self.sent else None,
+            'rtt_min': ms(self.minimum), 'rtt_max': ms(self.maximum),
+            'jitter': ms(self.jitter if self.received else None)
+        }
+        for quantile in self._quantiles:
+            stats['rtt_p%d' % (quantile.q * 100)] = ms(quantile.value)
+        return stats
+
+
+class Prober(object):
+    """
+    Send timestamped probes to targets at a fixed rate in background threads and collect their statistics.
+
+    Targets are URLs:
+
+    * ``udp://host:port`` -- send datagrams to an echo service, the round-trip time is measured up to the echo
+    * ``tcp://host:port`` -- measure the time to establish a TCP connection
+
+    The statistics are split between the probes sent while a throughput test is running (``loaded``, see
+    :meth:`loaded`) or not (``idle``).
+
+    **Example usage**
+
+    >>> import socket, time
+    >>> server = socket.socket()
+    >>> server.bind(('127.0.0.1', 0))
+    >>> server.listen(128)
+    >>> prober = Prober(['tcp://127.0.0.1:%d' % server.getsockname()[1]], rate=50)
+    >>> prober.start()
+    >>> time.sleep(0.2)
+    >>> with prober.loaded():
+    ...     time.sleep(0.2)
+    >>> prober.stop()
+    >>> stats = prober.snapshot()['tcp://127.0.0.1:%d' % server.getsockname()[1]]
+    >>> stats['idle']['received'] > 0 and stats['loaded']['received'] > 0
+    True
+    >>> stats['idle']['loss']
+    0.0
+    >>> server.close()
+    """
+
+    PROBE_FORMAT = b'!Id'
+
+    def __init__(self, targets, rate=10, timeout=1.0):
+        """
+        Construct a Prober.
+
+        :param targets: URLs of the targets (see above)
+        :type targets: list
+        :param rate: Number of probes per second (per target)
+        :type rate: float
+        :param timeout: Time after which a probe is considered lost (in seconds)
+        :type timeout: float
+        """
+        for target in targets:
+            if urlsplit(target).scheme not in ('tcp', 'udp'):
+                raise ValueError('Unsupported probe target {0}, use tcp://host:port or udp://host:port'.format(target))
+        self.targets = targets
+        self.interval = 1 / rate
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._load = 0
+        self._stats = self._new_stats()
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        self._running = True
+        for target in self.targets:
+            url = urlsplit(target)
+            worker = self._udp_worker if url.scheme == 'udp' else self._tcp_worker
+            thread = threading.Thread(target=worker, args=(target, (url.hostname, url.port)))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    @contextlib.contextmanager
+    def loaded(self):
+        """Context manager flagging the probes sent inside its block as sent under load."""
+        with self._lock:
+            self._load += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._load -= 1
+
+    def snapshot(self):
+        """Return the statistics (per target and phase) collected since the previous snapshot and reset them."""
+        with self._lock:
+            stats, self._stats = self._stats, self._new_stats()
+        return {t: {phase: s.stats for phase, s in phases.items()} for t, phases in stats.items()}
+
+    def _new_stats(self):
+        return {t: {'idle': LatencyStats(), 'loaded': LatencyStats()} for t in self.targets}
+
+    def _add(self, target, rtt, loaded):
+        with self._lock:
+            self._stats[target]['loaded' if loaded else 'idle'].add(rtt)
+
+    def _schedule(self):
+        """Yield the monotonic deadlines of the probes until the prober is stopped."""
+        deadline = time.monotonic()
+        while self._running:
+            yield deadline
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()  # Late, do not try to catch up
+
+    def _tcp_worker(self, target, address):
+        for deadline in self._schedule():
+            loaded, start_time = self._load > 0, time.monotonic()
+            try:
+                socket.create_connection(address, timeout=self.timeout).close()
+                rtt = time.monotonic() - start_time
+            except (socket.timeout, socket.error) as e:
+                if not isinstance(e, socket.timeout) and getattr(e, 'errno', None) != errno.ETIMEDOUT:
+                    log.debug('Probe to {0} failed, reason: {1}'.format(target, repr(e)))
+                rtt = None
+            self._add(target, rtt, loaded)
+
+    def _udp_worker(self, target, address):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(address)
+        sock.setblocking(False)
+        pending, sequence, size = {}, 0, struct.calcsize(self.PROBE_FORMAT)
+        try:
+            for deadline in self._schedule():
+                sequence = (sequence + 1) & 0xffffffff
+                now = time.monotonic()
+                pending[sequence] = (now, self._load > 0)
+                try:
+                    sock.send(struct.pack(self.PROBE_FORMAT, sequence, now))
+                except socket.error:
+                    pass  # e.g. ICMP port unreachable reported by a previous send, the probe will expire
+                # Receive the echoes until the next probe is due
+                while True:
+                    delay = deadline + self.interval - time.monotonic()
+                    if delay <= 0 or not select.select([sock], [], [], delay)[0]:
+                        break
+                    try:
+                        data = sock.recv(2048)
+                    except socket.error:
+                        continue
+                    if len(data) >= size:
+                        echoed = struct.unpack(self.PROBE_FORMAT, data[:size])[0]
+                        if echoed in pending:
+                            sent_time, loaded = pending.pop(echoed)
+                            self._add(target, time.monotonic() - sent_time, loaded)
+                # Expire the probes without echo
+                expired = time.monotonic() - self.timeout
+                for key in [k for k, (t, l) in pending.items() if t < expired]:
+                    self._add(target, None, pending.pop(key)[1])
+        finally:
+            sock.close()
@@ -0,0 +1,178 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .store import ColumnarStore, format_date, open_results
+
+PERCENTILES = (5, 50, 95)
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+
+def load_columns(results_path, keys=('download', 'upload')):
+    """
+    Return the dates and the `keys` columns of the results (any format) as arrays sorted by date.
+
+    The results without any of the `keys` (e.g. the results of the other targets) are filtered out.
+    """
+    results = open_results(results_path)
+    if isinstance(results, ColumnarStore):
+        columns = results.columns()
+        rows = len(columns['date'])
+        columns = {k: columns[k] if k in columns else numpy.full(rows, numpy.nan, 'f4') for k in ('date', ) + keys}
+    else:
+        points = list(results.iter_points())
+        columns = {'date': numpy.fromiter((t for t, v in points), dtype='i8', count=len(points))}
+        for key in keys:
+            columns[key] = numpy.fromiter((v.get(key, numpy.nan) for t, v in points), dtype='f4', count=len(points))
+    order = numpy.argsort(columns['date'], kind='stable')
+    order = order[~numpy.all([numpy.isnan(columns[k][order]) for k in keys], axis=0)]
+    return {k: numpy.asarray(c)[order] for k, c in columns.items()}
+
+
+def compute_stats(columns, sla=None, window=96, keys=('download', 'upload')):
+    """
+    Compute the statistics of the results with vectorized operations.
+
+    :param columns: The dates (int64 timestamps) and the speeds, see :func:`load_columns`
+    :type columns: dict
+    :param sla: Count the measures of the download speed (the first key) below this value (in Mbps)
+    :type sla: float
+    :param window: Size of the rolling median window (in measures)
+    :type window: int
+
+    **Example usage**
+
+    >>> dates = numpy.arange(48) * 3600  # Two days starting on a Thursday
+    >>> download = numpy.where(numpy.isin(dates // 3600 % 24, (20, 21)), 10.0, 100.0).astype('f4')
+    >>> stats = compute_stats({'date': dates, 'download': download, 'upload': download / 10}, sla=50, window=4)
+    >>> print(stats['count'], stats['sla']['breaches'], stats['sla']['hours'][20], stats['sla']['hours'][22])
+    48 4 2 0
+    >>> print(stats['download']['hours'][20]['p50'], stats['download']['hours'][19]['p50'])
+    10.0 100.0
+    >>> print(stats['download']['weekdays'][3]['count'], stats['download']['weekdays'][4]['count'])
+    24 24
+    >>> print(stats['download']['rolling_median']['min'])
+    {'date': '1970-01-01 21:00:00', 'value': 55.0}
+
+    The missing measures (NaN) are not taken into account to compute the ratio of the breaches of the SLA:
+
+    >>> download = numpy.array([10.0, numpy.nan, 100.0, 100.0], 'f4')
+    >>> stats = compute_stats({'date': numpy.arange(4), 'download': download}, sla=50, keys=('download', ))
+    >>> print(stats['sla']['ratio'])
+    0.3333333333333333
+    """
+    dates = numpy.asarray(columns['date'], dtype='i8')
+    stats = {'count': len(dates)}
+    if not len(dates):
+        return stats
+    stats.update({'first': format_date(int(dates[0])), 'last': format_date(int(dates[-1]))})
+    hours = (dates // 3600) % 24
+    weekdays = (dates // 86400 + 3) % 7  # 1970-01-01 was a Thursday
+    for key in keys:
+        values = numpy.asarray(columns[key], dtype='f8')
+        valid = ~numpy.isnan(values)
+        key_dates, values = dates[valid], values[valid]
+        stats[key] = {
+            'overall': group_percentiles(values, numpy.zeros(len(values), dtype='i8'), 1)[0],
+            'hours': group_percentiles(values, hours[valid], 24),
+            'weekdays': group_percentiles(values, weekdays[valid], 7),
+            'rolling_median': rolling_median_extrema(key_dates, values, window)
+        }
+    if sla is not None:
+        download = numpy.asarray(columns[keys[0]], dtype='f8')
+        breaches = download < sla  # NaN (missing) values are not breaches
+        measured = int(numpy.isfinite(download).sum())
+        stats['sla'] = {
+            'threshold': sla,
+            'breaches': int(breaches.sum()),
+            'ratio': float(breaches.sum() / measured) if measured else 0.0,
+            'hours': numpy.bincount(hours, weights=breaches, minlength=24).astype(int).tolist(),
+            'weekdays': numpy.bincount(weekdays, weights=breaches, minlength=7).astype(int).tolist()
+        }
+    return stats
+
+
+def group_percentiles(values, groups, size, percentiles=PERCENTILES):
+    """
+    Return, for every group in range(`size`), the number of values and their percentiles (linear interpolation).
+
+    The values are sorted once by group and value, the percentiles of all groups are then read at computed positions.
+
+    **Example usage**
+
+    >>> result = group_percentiles(numpy.array([1., 2., 3., 4., 10.]), numpy.array([0, 0, 0, 0, 2]), 3)
+    >>> print(result[0]['count'], result[0]['p50'], result[1], result[2]['p95'])
+    4 2.5 {'count': 0} 10.0
+    """
+    counts = numpy.bincount(groups, minlength=size)[:size]
+    result = [{'count': int(c)} for c in counts]
+    if not len(values):
+        return result
+    values = values[numpy.lexsort((values, groups))]
+    starts = numpy.r_[0, numpy.cumsum(counts)[:-1]]
+    non_empty = counts > 0
+    for percentile in percentiles:
+        positions = starts + (counts - 1).clip(0) * percentile / 100
+        lows = numpy.floor(positions).astype(int).clip(0, len(values) - 1)
+        highs = numpy.ceil(positions).astype(int).clip(0, len(values) - 1)
+        percentile_values = values[lows] + (values[highs] - values[lows]) * (positions - lows)
+        for group in numpy.flatnonzero(non_empty):
+            result[group]['p%d' % percentile] = round(float(percentile_values[group]), 3)
+    return result
+
+
+def rolling_median_extrema(dates, values, window, chunk_size=2 ** 22):
+    """
+    Return the minimum and the maximum of the rolling median of `values` (with the date ending the window).
+
+    The rolling medians are computed by chunks to bound the memory used to ``chunk_size`` values.
+    """
+    if len(values) < window:
+        return None
+    minimum = maximum = None
+    rows = max(1, chunk_size // window)
+    for start in range(0, len(values) - window + 1, rows):
+        chunk = values[start:start + rows + window - 1]
+        medians = numpy.median(sliding_window_view(chunk, window), axis=1)
+        low, high = int(medians.argmin()), int(medians.argmax())
+        if minimum is None or medians[low] < minimum[1]:
+            minimum = (start + low + window - 1, float(medians[low]))
+        if maximum is None or medians[high] > maximum[1]:
+            maximum = (start + high + window - 1, float(medians[high]))
+    return {
+        'window': window,
+        'min': {'date': format_date(int(dates[minimum[0]])), 'value': round(minimum[1], 3)},
+        'max': {'date': format_date(int(dates[maximum[0]])), 'value': round(maximum[1], 3)}
+    }
+
+
+def format_table(stats, keys=('download', 'upload')):
+    """Return the statistics formatted as text tables."""
+    if not stats['count']:
+        return 'No results.'
+    lines = ['{count} measures from {first} to {last}'.format(**stats)]
+    columns = ['%s p%d' % (k, p) for k in keys for p in PERCENTILES]
+    if 'sla' in stats:
+        lines.append('Download below {threshold} Mbps: {breaches} measures ({0:.1%})'.format(
+                     stats['sla']['ratio'], **stats['sla']))
+        columns.append('breaches')
+    for title, group, labels in (('Hour', 'hours', ['%02d' % h for h in range(24)]), ('Weekday', 'weekdays', WEEKDAYS)):
+        lines.extend(['', ' | '.join(['%-9s' % title, '%5s' % 'count'] + ['%13s' % c for c in columns])])
+        lines.append('-' * len(lines[-1]))
+        for index, label in enumerate(labels):
+            cells = ['%-9s' % label, '%5d' % stats[keys[0]][group][index]['count']]
+            for key in keys:
+                cells.extend('%13s' % stats[key][group][index].get('p%d' % p, '-') for p in PERCENTILES)
+            if 'sla' in stats:
+                cells.append('%13d' % stats['sla'][group][index])
+            lines.append(' | '.join(cells))
+    for key in keys:
+        rolling = stats[key]['rolling_median']
+        if rolling:
+            lines.append('')
+            lines.append('Rolling median of {0} ({1} measures): min {2[value]} at {2[date]}, max {3[value]} at '
+                         '{3[date]}'.format(key, rolling['window'], rolling['min'], rolling['max']))
+    return '\n'.join(lines)
@@ -0,0 +1,350 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import calendar, json, logging, numpy, os, time
+from codecs import open
+
+log = logging.getLogger('isp_benchmark')
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class JsonLinesStore(object):
+    """
+    An append-only storage of results, one JSON object per line.
+
+    Every result is written and synchronized to the disk as soon as it is appended, a run interrupted at any time only
+    loses the measurement in progress. An incomplete last line (e.g. power failure while writing) is ignored when
+    reading and removed before appending, this allows to resume a run by simply appending to an existing file.
+
+    **Example usage**
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'results.jsonl')
+    >>> with JsonLinesStore(path) as store:
+    ...     store.append({'date': '2014-01-01 00:00:00', 'download': 10.5, 'upload': 1.0})
+    ...     store.append({'date': '2014-01-01 00:15:00', 'download': 11.0, 'upload': 1.5})
+    >>> with open(path, 'a') as f:
+    ...     print('{"date": "2014-01-', end='', file=f)  # Simulate a crash while writing
+    >>> with JsonLinesStore(path) as store:
+    ...     print(len(store))
+    ...     store.append({'date': '2014-01-01 00:30:00', 'download': 9.0, 'upload': 1.0})
+    2
+    >>> [r['download'] for r in JsonLinesStore(path)]
+    [10.5, 11.0, 9.0]
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        """Yield the results one by one, the file is read incrementally."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        log.warning('Skip incomplete last line of {0}'.format(self.path))
+                        break
+                    if line.strip():
+                        yield json.loads(line)
+        except IOError:
+            if os.path.exists(self.path):
+                raise
+
+    def __len__(self):
+        return sum(1 for result in self)
+
+    def iter_points(self):
+        """Yield the results as (timestamp, values), see :func:`flatten`."""
+        for result in iter_results(self.path):
+            yield parse_date(result['date']), flatten(result)
+
+    def append(self, result):
+        """Append a result and synchronize it to the disk."""
+        if self._file is None:
+            self._truncate_incomplete_line()
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(result, sort_keys=True) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _truncate_incomplete_line(self):
+        try:
+            with open(self.path, 'rb+') as f:
+                f.seek(0, os.SEEK_END)
+                size = position = f.tell()
+                while position > 0:
+                    start = max(0, position - 4096)
+                    f.seek(start)
+                    index = f.read(position - start).rfind(b'\n')
+                    if index != -1:
+                        position = start + index + 1
+                        break
+                    position = start
+                if position != size:
+                    log.warning('Remove incomplete last line of {0}'.format(self.path))
+                    f.truncate(position)
+        except IOError:
+            if os.path.exists(self.path):
+                raise
+
+
+class ColumnarStore(object):
+    """
+    An append-only, memory-mappable columnar storage of results.
+
+    The store is a directory with one raw little-endian array per column: the timestamps (int64, seconds since epoch)
+    and the values returned by :func:`flatten` (float32, NaN when missing). The names of the columns are stored into
+    ``meta.json``. The columns are memory-mapped when read, opening years of results is instantaneous. Columns of
+    different lengths (e.g. power failure while appending) are truncated to the shortest one.
+
+    **Example usage**
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'results.isp')
+    >>> with ColumnarStore(path) as store:
+    ...     store.append({'date': '2014-01-01 00:00:00', 'download': 10.5, 'upload': 1.0})
+    ...     store.append({'date': '2014-01-01 00:15:00', 'download': 11.0, 'upload': 1.5, 'latency': {
+    ...         'udp://example.com:7': {'idle': {'rtt_p95': 20.0}, 'loaded': {'rtt_p95': 75.0}}}})
+    >>> store = ColumnarStore(path)
+    >>> len(store)
+    2
+    >>> columns = store.columns()
+    >>> print(columns['date'].dtype, columns['download'].dtype, columns['download'].tolist())
+    int64 float32 [10.5, 11.0]
+    >>> print(columns['udp://example.com:7 loaded'].tolist())
+    [nan, 75.0]
+    >>> [sorted(values) for timestamp, values in store.iter_points()][0]
+    ['download', 'upload']
+
+    The columns added while appending without synchronization are aligned too:
+
+    >>> path = os.path.join(tempfile.mkdtemp(), 'results.isp')
+    >>> with ColumnarStore(path) as store:
+    ...     for minute in range(3):
+    ...         store.append({'date': '2014-01-01 00:0%d:00' % minute, 'download': 10.0, 'upload': 1.0,
+    ...                       'target': 'lte' if minute == 2 else None}, sync=False)
+    >>> columns = ColumnarStore(path).columns()
+    >>> print(len(columns['date']), columns['download'].tolist(), columns['lte download'].tolist())
+    3 [10.0, 10.0, nan] [nan, nan, 10.0]
+    """
+
+    META_FILENAME = 'meta.json'
+    DATE_DTYPE = '<i8'
+    VALUE_DTYPE = '<f4'
+
+    def __init__(self, path):
+        self.path = path
+        self._files = None
+        self._meta = None
+        self._rows = 0  # Number of rows appended (including the buffered ones) once opened
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        meta = self._read_meta()
+        if not meta['columns']:
+            return 0
+        return min(os.path.getsize(self._column_path(f)) // numpy.dtype(self._dtype(n)).itemsize
+                   for n, f in meta['columns'].items())
+
+    def columns(self):
+        """Return a dictionary with the columns (read-only memory-mapped arrays)."""
+        rows, columns = len(self), {}
+        for name, filename in self._read_meta()['columns'].items():
+            dtype = self._dtype(name)
+            if rows:
+                columns[name] = numpy.memmap(self._column_path(filename), dtype=dtype, mode='r', shape=(rows, ))
+            else:
+                columns[name] = numpy.empty(0, dtype=dtype)
+        return columns
+
+    def iter_points(self):
+        """Yield the results as (timestamp, values), see :func:`flatten`."""
+        columns = self.columns()
+        dates = columns.pop('date', ())
+        for row, timestamp in enumerate(dates):
+            values = {}
+            for name, column in columns.items():
+                value = column[row]
+                if not numpy.isnan(value):
+                    values[name] = float(value)
+            yield int(timestamp), values
+
+    def append(self, result, sync=True):
+        """Append a result and synchronize it to the disk (if `sync` is True)."""
+        if self._files is None:
+            self._open()
+        values = flatten(result)
+        for name in sorted(set(values) - set(self._files)):
+            self._add_column(name, self._rows)
+        for name, f in self._files.items():
+            if name == 'date':
+                value = parse_date(result['date'])
+            else:
+                value = values.get(name)
+            f.write(numpy.array([numpy.nan if value is None else value], dtype=self._dtype(name)).tobytes())
+        self._rows += 1
+        if sync:
+            self.flush()
+
+    def flush(self):
+        for f in (self._files or {}).values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        if self._files is not None:
+            self.flush()
+            for f in self._files.values():
+                f.close()
+            self._files = None
+
+    def _open(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        meta, rows = self._read_meta(), len(self)
+        self._files, self._rows = {}, rows
+        for name, filename in meta['columns'].items():
+            path = self._column_path(filename)
+            size = rows * numpy.dtype(self._dtype(name)).itemsize
+            if os.path.getsize(path) != size:
+                log.warning('Truncate column {0} of {1} to {2} rows'.format(name, self.path, rows))
+                with open(path, 'rb+') as f:
+                    f.truncate(size)
+            self._files[name] = open(path, 'ab')
+        if 'date' not in self._files:
+            self._add_column('date', 0)
+
+    def _add_column(self, name, rows):
+        """Add a column filled with `rows` missing values (NaN)."""
+        meta = self._read_meta()
+        filename = 'date.bin' if name == 'date' else 'column-{0}.bin'.format(len(meta['columns']))
+        f = open(self._column_path(filename), 'wb')
+        f.write(numpy.full(rows, numpy.nan, dtype=self._dtype(name)).tobytes())
+        f.flush()
+        self._files[name] = f
+        meta['columns'][name] = filename
+        self._write_meta(meta)
+
+    def _column_path(self, filename):
+        return os.path.join(self.path, filename)
+
+    def _dtype(self, name):
+        return self.DATE_DTYPE if name == 'date' else self.VALUE_DTYPE
+
+    def _read_meta(self):
+        if self._meta is None:
+            try:
+                with open(self._column_path(self.META_FILENAME), 'r', encoding='utf-8') as f:
+                    self._meta = json.loads(f.read())
+            except IOError:
+                self._meta = {'version': 1, 'columns': {}}
+        return self._meta
+
+    def _write_meta(self, meta):
+        path = self._column_path(self.META_FILENAME)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(json.dumps(meta, sort_keys=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+
+
+def convert(source, destination):
+    """Convert the results stored into `source` (JSON or JSON lines) to a :class:`ColumnarStore` `destination`."""
+    count = 0
+    with ColumnarStore(destination) as store:
+        for result in iter_results(source):
+            store.append(result, sync=False)
+            count += 1
+    return count
+
+
+def open_results(path):
+    """Return the store of the results saved into `path`, a :class:`ColumnarStore` if `path` is a directory."""
+    return ColumnarStore(path) if os.path.isdir(path) else JsonLinesStore(path)
+
+
+def iter_results(path):
+    """
+    Yield the results stored into the file `path`.
+
+    Both the JSON lines files of :class:`JsonLinesStore` and the JSON files (a list of results) of the previous versions
+    are supported, only the later are loaded at once.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        first_char = f.read(1)
+        while first_char.isspace():
+            first_char = f.read(1)
+        if first_char == '[':
+            f.seek(0)
+            for result in json.loads(f.read()):
+                yield result
+            return
+    for result in JsonLinesStore(path):
+        yield result
+
+
+def flatten(result):
+    """
+    Return the numeric values of a result: the speeds and the 95th percentile of the round-trip times of the probes.
+
+    The keys of the values of a result tagged with a target (see :class:`pytoolbox_bin.tespeed.lib.Target`) are
+    prefixed by the name of the target.
+
+    **Example usage**
+
+    >>> values = flatten({'date': '2014-01-01 00:00:00', 'download': 10, 'upload': 1, 'latency': {
+    ...     'tcp://example.com:80': {'idle': {'rtt_p95': 12.5}, 'loaded': {'rtt_p95': 80.1}}
+    ... }})
+    >>> sorted(values.items())
+    [('download', 10), ('tcp://example.com:80 idle', 12.5), ('tcp://example.com:80 loaded', 80.1), ('upload', 1)]
+    >>> sorted(flatten({'date': '2014-01-01 00:00:00', 'download': 10, 'upload': 1, 'target': 'lte'}))
+    ['lte download', 'lte upload']
+    """
+    prefix = result['target'] + ' ' if result.get('target') else ''
+    values = {prefix + 'download': result['download'], prefix + 'upload': result['upload']}
+    for target, phases in result.get('latency', {}).items():
+        for phase, stats in phases.items():
+            values['%s%s %s' % (prefix, target, phase)] = stats['rtt_p95']
+    return values
+
+
+def is_speed(key):
+    """Return True if the value `key` (see :func:`flatten`) is a speed."""
+    return key.rsplit(' ', 1)[-1] in ('download', 'upload')
+
+
+def format_date(timestamp):
+    """
+    Return the UTC date string of `timestamp` in the format of :func:`pytoolbox.datetime.datetime_now`.
+
+    **Example usage**
+
+    >>> print(format_date(parse_date('2014-03-25 08:15:00')))
+    2014-03-25 08:15:00
+    """
+    return time.strftime(DATE_FORMAT, time.gmtime(timestamp))
+
+
+def parse_date(date):
+    """Return the timestamp of the UTC date string `date`."""
+    return calendar.timegm(time.strptime(date, DATE_FORMAT))
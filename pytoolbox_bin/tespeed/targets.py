@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+from codecs import open
+
+from .engine import HttpEngine
+from .lib import Target, tespeed
+from .probes import Prober
+
+
+def load_targets(filename):
+    """
+    Return the targets (see :class:`pytoolbox_bin.tespeed.lib.Target`) described into the JSON file `filename`, a list
+    of objects with the following keys:
+
+    * ``name`` -- Name of the target (required, unique)
+    * ``engine`` -- ``tespeed`` (default) or ``http``
+    * ``url``, ``upload_url``, ``streams``, ``duration`` -- Options of the http engine, see :class:`HttpEngine`
+    * ``probes``, ``probe_rate`` -- URLs of the latency probes and number of probes per second, see :class:`Prober`
+
+    **Example usage**
+
+    >>> import os, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'targets.json')
+    >>> with open(filename, 'w') as f:
+    ...     print('[{"name": "fiber", "engine": "http", "url": "http://fiber.example.com/10M", "streams": 8},'
+    ...           ' {"name": "lte", "probes": ["tcp://lte.example.com:80"]}]', file=f)
+    >>> fiber, lte = load_targets(filename)
+    >>> print(fiber.name, fiber.engine.streams, fiber.prober, lte.engine.__name__, lte.prober.targets)
+    fiber 8 None tespeed ['tcp://lte.example.com:80']
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        config = json.loads(f.read())
+    targets, names = [], set()
+    for options in config:
+        name = options.get('name')
+        if not name or name in names:
+            raise ValueError('Target names must be set and unique, got {0!r}'.format(name))
+        names.add(name)
+        engine_name = options.get('engine', 'tespeed')
+        if engine_name == 'http':
+            if not options.get('url'):
+                raise ValueError('Target {0} uses the http engine and requires an URL'.format(name))
+            engine = HttpEngine(options['url'], options.get('upload_url'), streams=options.get('streams', 4),
+                                duration=options.get('duration', 10))
+        elif engine_name == 'tespeed':
+            engine = tespeed
+        else:
+            raise ValueError('Target {0} uses an unknown engine {1}'.format(name, engine_name))
+        probes = options.get('probes')
+        prober = Prober(probes, rate=options.get('probe_rate', 10)) if probes else None
+        targets.append(Target(name, engine, prober))
+    return targets
@@ -2,17 +2,16 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import argparse, httplib2, json, os, sys
+import argparse, httplib2, json, os, sys, time
 from codecs import open
 from apiclient import discovery
 from oauth2client import client, file, tools
 from pytoolbox.encoding import configure_unicode
-from pytoolbox.filesystem import try_makedirs, try_remove
-from pytoolbox.network.http import download
+from pytoolbox.filesystem import try_makedirs
 from pytoolbox.serialization import object_to_json
-from youtube_dl.YoutubeDL import YoutubeDL
 
-from .lib import Like
+from .index import DOWNLOADED, FAILED, LikesIndex
+from .lib import Like, LikesDownloader, ThumbnailsDownloader, sync_likes
 from ..common import error, config_path
 
 
@@ -23,11 +22,28 @@ def download_likes():
     HELP_OUTPUT, DEFAULT_OUTPUT = 'Download directory', os.path.abspath(os.path.expanduser('~/youtube_likes'))
     HELP_UPDATE = 'Request the likes with the YouTube API'
     HELP_THUMBNAIL, DEFAULT_THUMBNAIL = 'Download the thumbnails', False
+    HELP_THUMBNAIL_JOBS, DEFAULT_THUMBNAIL_JOBS = 'Number of thumbnails downloaded concurrently', 8
+    HELP_JOBS, DEFAULT_JOBS = 'Number of videos downloaded concurrently', 4
+    HELP_FULL_SYNC = 'Request all the likes and not only the new ones (to catch the removed likes)'
+    HELP_SYNC_INTERVAL, DEFAULT_SYNC_INTERVAL = 'Days between two automatic full synchronizations of the likes', 7
+    HELP_KNOWN_RUN, DEFAULT_KNOWN_RUN = 'Stop requesting the likes after this number of consecutive known likes', 50
+    HELP_RETRIES, DEFAULT_RETRIES = 'Number of times a failed download is retried during the run', 2
+    HELP_RETRY_NOW = 'Retry the downloads that failed during the previous runs without waiting for their delay'
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      epilog=download_likes.__doc__, parents=[tools.argparser])
     parser.add_argument('-o', '--output',    action='store',       help=HELP_OUTPUT,    default=DEFAULT_OUTPUT)
     parser.add_argument('-t', '--thumbnail', action='store_true',  help=HELP_THUMBNAIL, default=DEFAULT_THUMBNAIL)
     parser.add_argument('-u', '--update',    action='store_false', help=HELP_UPDATE)
+    parser.add_argument('-j', '--jobs',      action='store',       help=HELP_JOBS,      default=DEFAULT_JOBS, type=int)
+    parser.add_argument('--thumbnail-jobs', action='store', help=HELP_THUMBNAIL_JOBS, default=DEFAULT_THUMBNAIL_JOBS,
+                        type=int)
+    parser.add_argument('-f', '--full-sync', action='store_true',  help=HELP_FULL_SYNC)
+    parser.add_argument('-s', '--full-sync-interval', action='store', help=HELP_SYNC_INTERVAL,
+                        default=DEFAULT_SYNC_INTERVAL, type=float)
+    parser.add_argument('-k', '--known-run', action='store', help=HELP_KNOWN_RUN, default=DEFAULT_KNOWN_RUN, type=int)
+    parser.add_argument('-r', '--retries',   action='store',       help=HELP_RETRIES,   default=DEFAULT_RETRIES,
+                        type=int)
+    parser.add_argument('-R', '--retry-now', action='store_true',  help=HELP_RETRY_NOW)
     args = parser.parse_args(sys.argv[1:])
 
     output_directory = os.path.abspath(os.path.expanduser(args.output))
@@ -58,42 +74,43 @@ def download_likes():
     service = discovery.build('youtube', 'v3', http=http)
     likes_filename = config_path('likes.json')
 
-    likes = []
-    if not args.update:
-        try:
-            with open(likes_filename, 'r', 'utf-8') as f:
-                likes = [Like(**like_dict) for like_dict in json.loads(f.read())]
-        except IOError:
-            pass
-
-    local_likes = {}
-    for dirpath, dirnames, filenames in os.walk(output_directory):
-        for filename in (unicode(f, 'utf-8') for f in filenames):
-            like = Like.from_filename(os.path.join(dirpath, filename))
-            if not like:
-                error('Unable to parse components of filename "{0}"'.format(filename), 1)
-            local_likes.setdefault(like.id, like)
-
-    if not likes:
+    stored = None
+    try:
+        with open(likes_filename, 'r', 'utf-8') as f:
+            stored = [Like(**like_dict) for like_dict in json.loads(f.read())]
+    except IOError:
+        pass
+    likes = stored or []
+
+    index = LikesIndex(config_path('likes.sqlite'))
+    listed, removed, added = index.reconcile(output_directory)
+    print('Index updated, listed {0} directories ({1} videos removed and {2} added)'.format(listed, removed, added))
+    local_likes = index.downloaded(output_directory)
+
+    if args.update or not likes:
+        full = args.full_sync or not stored or \
+            time.time() - float(index.get('likes_full_sync', 0)) > args.full_sync_interval * 86400
+
+        def list_page(page):
+            print('Read page {0}'.format(page))
+            return service.videos().list(part='id,snippet', myRating='like', maxResults=50, pageToken=page).execute()
+
         try:
-            page = None
-            while True:
-                print('Read page {0}'.format(page))
-                response = service.videos().list(part='id,snippet', myRating='like', maxResults=50,
-                                                 pageToken=page).execute()
-                likes += [Like.from_api_response(item, output_directory) for item in response['items']]
-                page = response.get('nextPageToken')
-                if not page:
-                    break
-            print('Retrieved {0} likes from your activity in YouTube.'.format(len(likes)))
+            likes, pages = sync_likes(list_page, output_directory, None if full else stored, args.known_run)
+            if full:
+                index.set('likes_full_sync', str(time.time()))
+            print('Retrieved {0} likes from your activity in YouTube ({1} synchronization, {2} pages).'.format(
+                  len(likes), 'full' if full else 'incremental', pages))
             with open(likes_filename, 'w', 'utf-8') as f:
                 f.write(object_to_json(likes, include_properties=False))
         except client.AccessTokenRefreshError:
             error('The credentials have been revoked or expired, please re-run the application to re-authorize', 2)
 
+    failed = index.failed()
     deleted_ids = set()
-    errored_ids = set()
-    downloaded = renamed = 0
+    postponed_ids = set()
+    renamed = 0
+    present, to_download = [], []
     for like in likes:
         if like.deleted:
             deleted_ids.add(like.id)
@@ -105,24 +122,53 @@ def download_likes():
                     print('Rename already downloaded video "{0.title}" to "{1.title}"'.format(local_like, like))
                     renamed += 1
                     os.rename(local_like.video, like.video)
+                    if os.path.exists(local_like.thumbnail):
+                        os.rename(local_like.thumbnail, like.thumbnail)
+                    index.add(like)
                 else:
                     print('Skip already downloaded video "{0.title}"'.format(local_like))
+                present.append(like)
+            elif like.id in failed and failed[like.id][1] > time.time() and not args.retry_now:
+                print('Postpone download of video "{0.title}" (attempt {1} failed)'.format(like, failed[like.id][0]))
+                postponed_ids.add(like.id)
             else:
-                print('Downloading video "{0.title}"'.format(like))
-                ydl = YoutubeDL({'outtmpl': like.video})
-                ydl.add_default_info_extractors()
-                try:
-                    ydl.download([like.id])
-                    if args.thumbnail:
-                        download(like.thumbnail_url, like.thumbnail)
-                    downloaded += 1
-                except Exception as e:
-                    error('Download failed, reason: {0}'.format(repr(e)), None)
-                    errored_ids.add(like.id)
-                    try_remove(like.video)
-                    if args.thumbnail:
-                        try_remove(like.thumbnail)
+                if like.id in failed and failed[like.id][2]:
+                    print('Resume download of video "{0.title}" at {1} bytes'.format(like, failed[like.id][2]))
+                to_download.append(like)
+
+    def progress(like, exception, downloader, retry):
+        if retry is None:
+            index.add(like, status=FAILED if exception else DOWNLOADED)
+        if exception is None:
+            print('Downloaded video "{0.title}"'.format(like))
+            if args.thumbnail:
+                thumbnails.add(like)
+        elif retry is not None:
+            print('Download of video "{0.title}" failed, retry in {1} seconds, reason: {2}'.format(
+                  like, retry, repr(exception)))
+        else:
+            error('Download of video "{0.title}" failed, reason: {1}'.format(like, repr(exception)), None)
+        print('[{0}/{1}] Downloaded {2}, failed {3}, remaining {4}'.format(
+              len(to_download) - downloader.remaining, len(to_download), downloader.downloaded,
+              len(downloader.errored_ids), downloader.remaining))
+
+    thumbnails = ThumbnailsDownloader(jobs=args.thumbnail_jobs)
+    if args.thumbnail:
+        thumbnails.start(present)
+
+    print('Downloading {0} videos with {1} workers'.format(len(to_download), args.jobs))
+    downloader = LikesDownloader(jobs=args.jobs, callback=progress, retries=args.retries)
+    completed = False
+    try:
+        downloaded, errored_ids = downloader.download(to_download)
+        completed = True
+    finally:
+        index.close()
+        counts = thumbnails.wait(cancel=not completed)
 
     print('Successfully processed {0} likes! (renamed {1} and downloaded {2})'.format(len(likes), renamed, downloaded))
     print('There are {0} deleted likes: {1}'.format(len(deleted_ids), deleted_ids))
     print('There are {0} error-ed likes: {1}'.format(len(errored_ids), errored_ids))
+    print('There are {0} postponed likes: {1}'.format(len(postponed_ids), postponed_ids))
+    if args.thumbnail:
+        print('Thumbnails: downloaded {downloaded}, skipped {skipped} and failed {failed}'.format(**counts))
@@ -0,0 +1,220 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging, os, sqlite3, time
+
+from .lib import Like
+
+log = logging.getLogger(__name__)
+
+DOWNLOADED, FAILED = 'downloaded', 'failed'
+IGNORED_SUFFIXES = ('.jpg', '.part', '.ytdl', '.tmp')
+RETRY_DELAY, MAX_RETRY_DELAY = 3600, 86400
+
+
+class LikesIndex(object):
+    """
+    A persistent index of the downloaded likes (SQLite), maps the ids of the videos to their path, size and status.
+
+    The index is reconciled with the download directory incrementally: only the directories with a modification time
+    that changed since the last reconciliation are listed (adding, removing or renaming a file updates the modification
+    time of its directory). Startup is instantaneous for huge libraries and the files with a name that cannot be parsed
+    are skipped with a warning.
+
+    The failed downloads are recorded with the size of their partial file (resumed by the next download), the number of
+    attempts and the date of the next attempt (the delay doubles after every attempt).
+
+    **Example usage**
+
+    >>> import os, tempfile
+    >>> directory, index_path = tempfile.mkdtemp(), os.path.join(tempfile.mkdtemp(), 'likes.sqlite')
+    >>> os.makedirs(os.path.join(directory, 'music'))
+    >>> for name in ('music/Song_abcdefghijk.mp4', 'music/Song_abcdefghijk.jpg', 'Talk_bcdefghijkl.mp4', 'notes'):
+    ...     with open(os.path.join(directory, name), 'w') as f:
+    ...         _ = f.write('data')
+    >>> with LikesIndex(index_path) as index:
+    ...     index.reconcile(directory)
+    ...     print(sorted((like.id, like.title) for like in index.downloaded(directory).values()))
+    (2, 0, 2)
+    [('abcdefghijk', 'Song'), ('bcdefghijkl', 'Talk')]
+    >>> os.remove(os.path.join(directory, 'Talk_bcdefghijkl.mp4'))
+    >>> with LikesIndex(index_path) as index:
+    ...     index.reconcile(directory)
+    ...     print(sorted(index.downloaded(directory)))
+    (1, 1, 0)
+    ['abcdefghijk']
+
+    The sub-directories are matched by prefix, the wildcards of SQL patterns are not special:
+
+    >>> for name in ('a_b/Song_defghijklmn.mp4', 'aXb/Song_efghijklmno.mp4'):
+    ...     os.makedirs(os.path.join(directory, os.path.dirname(name)))
+    ...     with open(os.path.join(directory, name), 'w') as f:
+    ...         _ = f.write('data')
+    >>> with LikesIndex(index_path) as index:
+    ...     _ = index.reconcile(directory)
+    ...     _ = index._remove_directory(os.path.join(directory, 'a_b'))
+    ...     print(sorted(index.downloaded(os.path.join(directory, 'a_b'))), len(index.downloaded(directory)))
+    [] 2
+    >>> with LikesIndex(index_path) as index:
+    ...     index.add(Like('cdefghijklm', 'Live', directory), status=FAILED)
+    ...     index.add(Like('cdefghijklm', 'Live', directory), status=FAILED)
+    ...     attempts, retry_at, offset = index.failed()['cdefghijklm']
+    ...     print(attempts, 7000 < retry_at - time.time() <= 7200, offset)
+    2 True None
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS likes (
+            id TEXT PRIMARY KEY, directory TEXT NOT NULL, path TEXT NOT NULL, size INTEGER, status TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS likes_directory ON likes (directory);
+        CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, parent TEXT, mtime REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+        CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(self.SCHEMA)
+        # Add the columns of the failed downloads to an index created by a previous version, they are retried now
+        columns = set(row[1] for row in self.connection.execute('PRAGMA table_info(likes)'))
+        with self.connection:
+            for name, definition in (('offset', 'INTEGER'), ('attempts', 'INTEGER DEFAULT 0'),
+                                     ('retry_at', 'REAL DEFAULT 0')):
+                if name not in columns:
+                    self.connection.execute('ALTER TABLE likes ADD COLUMN {0} {1}'.format(name, definition))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def downloaded(self, directory):
+        """Return a dictionary with the likes downloaded into `directory` (and its sub-directories) by id."""
+        likes = {}
+        prefix = directory.rstrip(os.sep) + os.sep
+        for id, path in self.connection.execute(
+            "SELECT id, path FROM likes WHERE status = ? AND (directory = ? OR substr(directory, 1, ?) = ?)",
+            (DOWNLOADED, directory, len(prefix), prefix)
+        ):
+            like = Like.from_filename(path)
+            if like:
+                likes[id] = like
+        return likes
+
+    def failed(self):
+        """Return a dictionary with the number of attempts, the date of the next attempt and the offset by id."""
+        return {i: (a, r, o) for i, a, r, o in self.connection.execute(
+            "SELECT id, attempts, retry_at, offset FROM likes WHERE status = ?", (FAILED, ))}
+
+    def add(self, like, status=DOWNLOADED):
+        """
+        Add or update the entry of a like, the size of the video (or of its partial file) is updated from the file
+        system. The number of attempts and the date of the next attempt of a failed download are updated.
+        """
+        size = offset = retry_at = None
+        attempts = 0
+        try:
+            size = os.path.getsize(like.video)
+        except OSError:
+            pass
+        if status == FAILED:
+            try:
+                offset = os.path.getsize(like.video + '.part')
+            except OSError:
+                pass
+            row = self.connection.execute("SELECT attempts FROM likes WHERE id = ? AND status = ?",
+                                          (like.id, FAILED)).fetchone()
+            attempts = (row[0] or 0) + 1 if row else 1
+            retry_at = time.time() + min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO likes (id, directory, path, size, status, offset, attempts, retry_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (like.id, like.directory, like.video, size, status, offset, attempts, retry_at))
+
+    def get(self, key, default=None):
+        """Return the value of the setting `key` (e.g. the date of the last full synchronization of the likes)."""
+        row = self.connection.execute("SELECT value FROM settings WHERE key = ?", (key, )).fetchone()
+        return default if row is None else row[0]
+
+    def set(self, key, value):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    def reconcile(self, root):
+        """
+        Update the index with the files of `root`, only the modified directories are listed.
+
+        Return the number of directories listed, the number of files removed and the number of files added.
+        """
+        listed = removed = added = 0
+        stack = [os.path.abspath(root)]
+        with self.connection:
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except OSError:
+                    removed += self._remove_directory(directory)
+                    continue
+                row = self.connection.execute("SELECT mtime FROM directories WHERE path = ?", (directory, )).fetchone()
+                if row and row[0] == mtime:
+                    stack.extend(p for p, in self.connection.execute(
+                        "SELECT path FROM directories WHERE parent = ?", (directory, )))
+                    continue
+                listed += 1
+                likes, subdirectories = self._list_directory(directory)
+                known = {i: p for i, p in self.connection.execute(
+                    "SELECT id, path FROM likes WHERE directory = ? AND status = ?", (directory, DOWNLOADED))}
+                for id in set(known) - set(likes):
+                    self.connection.execute("DELETE FROM likes WHERE id = ?", (id, ))
+                    removed += 1
+                for id, (like, size) in likes.items():
+                    if known.get(id) != like.video:
+                        added += 1
+                    self.connection.execute("INSERT OR REPLACE INTO likes (id, directory, path, size, status) "
+                                            "VALUES (?, ?, ?, ?, ?)", (id, directory, like.video, size, DOWNLOADED))
+                for path, in self.connection.execute(
+                        "SELECT path FROM directories WHERE parent = ?", (directory, )).fetchall():
+                    if path not in subdirectories:
+                        removed += self._remove_directory(path)
+                self.connection.execute("INSERT OR REPLACE INTO directories (path, parent, mtime) VALUES (?, ?, ?)",
+                                        (directory, os.path.dirname(directory), mtime))
+                stack.extend(subdirectories)
+        return listed, removed, added
+
+    def _list_directory(self, directory):
+        likes, subdirectories = {}, []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                if not name.startswith('.'):
+                    subdirectories.append(path)
+                continue
+            if name.startswith('.') or name.endswith(IGNORED_SUFFIXES):
+                continue
+            like = Like.from_filename(path)
+            if like:
+                likes.setdefault(like.id, (like, os.path.getsize(path)))
+            else:
+                log.warning('Skip file "{0}", unable to parse the components of its name'.format(path))
+        return likes, subdirectories
+
+    def _remove_directory(self, directory):
+        """Remove a directory (and its sub-directories) from the index, return the number of likes removed."""
+        # A prefix and not a pattern (LIKE), the paths may contain its wildcards (e.g. the default ~/youtube_likes)
+        prefix = directory.rstrip(os.sep) + os.sep
+        count = self.connection.execute(
+            "DELETE FROM likes WHERE status = ? AND (directory = ? OR substr(directory, 1, ?) = ?)",
+            (DOWNLOADED, directory, len(prefix), prefix)).rowcount
+        self.connection.execute("DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?",
+                                (directory, len(prefix), prefix))
+        return count
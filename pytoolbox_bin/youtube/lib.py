@@ -2,7 +2,10 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import os, re
+import heapq, httplib2, itertools, os, re, threading, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pytoolbox.filesystem import try_remove
+from youtube_dl.YoutubeDL import YoutubeDL
 
 
 class Like(object):
@@ -43,6 +46,227 @@ class Like(object):
             return None
 
 
+class LikesDownloader(object):
+    """
+    Download the videos of likes with a pool of threads.
+
+    Every worker reuses its own instance of :class:`YoutubeDL` (they are not thread-safe), only the output template is
+    changed from a video to another. The progress of the downloads of the workers is not printed (it would be mixed
+    up), the outcome of every download is given to the callback instead.
+
+    An interrupted download is kept as a partial file (``.part``) and resumed where it stopped (with range requests) by
+    the next attempt. The failed downloads are retried after a delay doubling after every attempt, the workers are free
+    to download other videos meanwhile.
+    """
+
+    def __init__(self, jobs=4, callback=None, retries=2, backoff=10):
+        """
+        Construct a LikesDownloader.
+
+        :param jobs: Number of videos downloaded concurrently
+        :type jobs: int
+        :param callback: Called with the like, the error (None if successful), the downloader and the delay before the
+                         next attempt (None if not retried) after every attempt
+        :type callback: callable
+        :param retries: Number of times a failed download is retried
+        :type retries: int
+        :param backoff: Delay before the first retry (in seconds)
+        :type backoff: float
+        """
+        self.jobs = jobs
+        self.callback = callback
+        self.retries = retries
+        self.backoff = backoff
+        self.downloaded = 0
+        self.errored_ids = set()
+        self.remaining = 0
+        self._local = threading.local()
+
+    @property
+    def youtube_dl(self):
+        """Return the instance of :class:`YoutubeDL` of the current thread."""
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            ydl = self._local.ydl = YoutubeDL({
+                'continuedl': True, 'nopart': False, 'quiet': self.jobs > 1, 'noprogress': self.jobs > 1
+            })
+            ydl.add_default_info_extractors()
+        return ydl
+
+    def download(self, likes):
+        """Download the `likes`, return the number of videos downloaded and the ids of the likes that failed."""
+        self.remaining = len(likes)
+        executor = ThreadPoolExecutor(max_workers=self.jobs)
+        futures = {executor.submit(self.download_like, like): 0 for like in likes}
+        delayed, counter = [], itertools.count()  # The retry queue, sorted by date of the next attempt
+        try:
+            while futures or delayed:
+                while delayed and delayed[0][0] <= time.time():
+                    _, _, like, attempt = heapq.heappop(delayed)
+                    futures[executor.submit(self.download_like, like)] = attempt
+                timeout = max(0, delayed[0][0] - time.time()) if delayed else None
+                if not futures:
+                    time.sleep(timeout)  # Only retries are pending (wait would return immediately)
+                    continue
+                for future in wait(futures, timeout=timeout, return_when=FIRST_COMPLETED).done:
+                    attempt = futures.pop(future)
+                    like, exception = future.result()
+                    delay = None
+                    if exception is None:
+                        self.downloaded += 1
+                        self.remaining -= 1
+                    elif attempt < self.retries:
+                        delay = self.backoff * 2 ** attempt
+                        heapq.heappush(delayed, (time.time() + delay, next(counter), like, attempt + 1))
+                    else:
+                        self.errored_ids.add(like.id)
+                        self.remaining -= 1
+                    if self.callback:
+                        self.callback(like, exception, self, delay)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return self.downloaded, self.errored_ids
+
+    def download_like(self, like):
+        """
+        Download the video of a like, return the like and the exception (None if successful).
+
+        The partial file (``.part``) of an interrupted download is kept to resume the download. The video is removed if
+        the download failed after it was complete (e.g. post-processing), it would be taken for a downloaded video.
+        """
+        ydl = self.youtube_dl
+        ydl.params['outtmpl'] = like.video
+        try:
+            ydl.download([like.id])
+            return like, None
+        except Exception as e:
+            try_remove(like.video)
+            return like, e
+
+
+class ThumbnailsDownloader(object):
+    """
+    Download the thumbnails of likes in background with a pool of threads, besides the videos.
+
+    Only the thumbnails of the videos present are downloaded: the videos already downloaded are given when starting and
+    the others are added once downloaded (see :meth:`add`), a video that failed does not leave a thumbnail behind.
+
+    Every worker reuses its own :class:`httplib2.Http` client, the connections to the servers of the thumbnails are kept
+    alive from a thumbnail to another. A thumbnail already downloaded is skipped if its size matches the size returned
+    by the server (a ``HEAD`` request).
+    """
+
+    def __init__(self, jobs=8, timeout=30):
+        self.jobs = jobs
+        self.timeout = timeout
+        self._executor = None
+        self._futures = []
+        self._local = threading.local()
+
+    @property
+    def http(self):
+        """Return the HTTP client of the current thread."""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = httplib2.Http(timeout=self.timeout)
+        return http
+
+    def start(self, likes=()):
+        """Start downloading the thumbnails of the `likes` in background."""
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+        for like in likes:
+            self.add(like)
+
+    def add(self, like):
+        """Add the thumbnail of a like to download (once started)."""
+        if like.thumbnail_url:
+            self._futures.append(self._executor.submit(self.download_thumbnail, like))
+
+    def wait(self, cancel=False):
+        """Wait for the thumbnails and return the number of thumbnails by status (downloaded, skipped or failed)."""
+        counts = {'downloaded': 0, 'skipped': 0, 'failed': 0}
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=cancel)
+            for future in self._futures:
+                if not future.cancelled():
+                    counts[future.result()] += 1
+        return counts
+
+    def download_thumbnail(self, like):
+        """Download the thumbnail of a like if missing or changed, return the status."""
+        try:
+            http = self.http
+            if os.path.exists(like.thumbnail):
+                response, content = http.request(like.thumbnail_url, 'HEAD')
+                if response.status == 200 and response.get('content-length') == str(os.path.getsize(like.thumbnail)):
+                    return 'skipped'
+            response, content = http.request(like.thumbnail_url)
+            if response.status != 200:
+                raise IOError('HTTP status {0}'.format(response.status))
+            with open(like.thumbnail + '.tmp', 'wb') as f:
+                f.write(content)
+            os.rename(like.thumbnail + '.tmp', like.thumbnail)
+            return 'downloaded'
+        except Exception:
+            try_remove(like.thumbnail + '.tmp')
+            return 'failed'
+
+
+def sync_likes(list_page, directory, stored=None, known_run=50):
+    """
+    Request the likes page by page (newest first) and merge them into the `stored` likes.
+
+    The paging stops after `known_run` consecutive likes that are already stored (the following ones are known too),
+    the likes requested replace the stored ones (e.g. title updated) and the new ones are prepended. All the pages are
+    requested if `stored` is None (a full synchronization), this is the only way to catch the likes removed since.
+
+    :param list_page: Called with the token of the page (None for the first) to request a page of the likes
+    :type list_page: callable
+    :param directory: Download directory of the likes
+    :type directory: str
+    :param stored: The likes retrieved by a previous synchronization
+    :type stored: list
+    :param known_run: Number of consecutive known likes to stop the paging
+    :type known_run: int
+
+    Return the likes and the number of pages requested.
+
+    **Example usage**
+
+    >>> def list_page(ids, size=3):
+    ...     def list_page(page):
+    ...         start = int(page or 0)
+    ...         items = [{'id': i, 'snippet': {'title': 'Video ' + i}} for i in ids[start:start + size]]
+    ...         return {'items': items, 'nextPageToken': str(start + size) if start + size < len(ids) else None}
+    ...     return list_page
+    >>> likes, pages = sync_likes(list_page(['d', 'c', 'b', 'a']), '/tmp')
+    >>> print([like.id for like in likes], pages)
+    ['d', 'c', 'b', 'a'] 2
+    >>> likes, pages = sync_likes(list_page(['f', 'e', 'd', 'c', 'b', 'a']), '/tmp', likes, known_run=2)
+    >>> print([like.id for like in likes], pages)
+    ['f', 'e', 'd', 'c', 'b', 'a'] 2
+    """
+    likes, ids, run, page, pages = [], set(), 0, None, 0
+    known_ids = None if stored is None else set(like.id for like in stored)
+    while True:
+        response = list_page(page)
+        pages += 1
+        for item in response['items']:
+            like = Like.from_api_response(item, directory)
+            if like.id not in ids:
+                ids.add(like.id)
+                likes.append(like)
+            run = run + 1 if known_ids is not None and like.id in known_ids else 0
+            if run >= known_run:
+                break
+        page = response.get('nextPageToken')
+        if not page or run >= known_run:
+            break
+    if stored is not None:
+        likes += [like for like in stored if like.id not in ids]
+    return likes, pages
+
+
 def remove_special_chars(filename):
     return (filename.replace('?', '').replace('"', '').replace('/', '-')
                     .replace('|', '-').replace(':', '-').replace('*', '-'))
@@ -82,6 +82,7 @@ setup(name='pytoolbox_bin',
       entry_points={
           'console_scripts': [
               'github-clone-starred=pytoolbox_bin.github.bin:clone_starred',
+              'github-benchmark-clones=pytoolbox_bin.github.bin:benchmark_clones',
               'youtube-download-likes=pytoolbox_bin.youtube.bin:download_likes',
               'socket-fec-generator=pytoolbox_bin.smpte2022.bin:socket_fec_generator',
               'twisted-fec-generator=pytoolbox_bin.smpte2022.bin:twisted_fec_generator',